@@ -0,0 +1,237 @@
+import glob
+import multiprocessing
+import multiprocessing.synchronize
+import os
+import queue
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator, NamedTuple
+
+import data_parser
+import instrumentation
+from checkpoint import Checkpoint
+from data_parser import EmailMessage, EmailRecord, ExtractionOptions
+from extraction_cache import ExtractionCache
+
+# Records a worker sends back at a time, and how many of those can wait for the main process per export. Workers
+# that get ahead wait, so memory doesn't grow with the size of the exports
+CHUNK_SIZE = data_parser.WORKER_CHUNK_SIZE
+QUEUE_CHUNKS = 4
+# Seconds between checks that the run wasn't stopped, while a worker waits on a full queue / we wait on a worker
+POLL_INTERVAL = 0.1
+
+
+class FileStats(NamedTuple):
+    """
+    How long a single export in a batch took to decode
+    """
+    file: str
+    messages: int
+    duplicates: int
+    seconds: float
+
+    def __str__(self):
+        rate = self.messages / self.seconds if self.seconds else 0
+        return f"{os.path.basename(self.file)}: {self.messages:,} messages ({self.duplicates:,} duplicates) in {self.seconds:.1f}s, {rate:,.0f} msg/s"
+
+
+def find_exports(path: str) -> list[str]:
+    """
+    Every .pst file in a directory, or every .pst file matching a glob (ie. `exports/*_2024.pst`)
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, "*.pst")
+
+    return sorted(i for i in glob.glob(path) if i.endswith(".pst"))
+
+
+# Set in every worker by _init_worker(): the queue per export its chunks go in, and the event that stops the run
+_worker_queues: tuple[list[multiprocessing.Queue], multiprocessing.synchronize.Event] | None = None
+
+
+def _init_worker(queues: list[multiprocessing.Queue], stop: multiprocessing.synchronize.Event):
+    """
+    Runs once in every worker process, queues can only be handed to workers when they're started
+    """
+    global _worker_queues
+    _worker_queues = queues, stop
+
+    # Chunks the main process never reads (ie. it stopped early) would otherwise keep the worker from exiting
+    for i in queues:
+        i.cancel_join_thread()
+
+
+def _put(chunks: multiprocessing.Queue, item, stop: multiprocessing.synchronize.Event) -> bool:
+    """
+    Puts into a (full) queue, False if the run was stopped while waiting
+    """
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def _extract_file(email_export_file: str, export_index: int, cache_file: str | None,
+                  options: ExtractionOptions) -> tuple[float, instrumentation.Stats]:
+    """
+    Runs in a worker process, decodes an export into records that are put in its queue in chunks as they're
+    decoded, then None. Stops early if the run is stopped, ie. the main process stopped reading
+    """
+    chunks, stop = _worker_queues[0][export_index], _worker_queues[1]
+    data_parser.stats.reset()
+    start = time.perf_counter()
+    cache = ExtractionCache(cache_file) if cache_file else None
+
+    messages = data_parser.iter_emails(email_export_file, cache=cache, options=options)
+    try:
+        chunk = []
+        for m in messages:
+            chunk.append(m.to_record())
+            if len(chunk) >= CHUNK_SIZE:
+                if not _put(chunks, chunk, stop):
+                    break
+                chunk = []
+        else:
+            if chunk:
+                _put(chunks, chunk, stop)
+            _put(chunks, None, stop)
+    finally:
+        messages.close()
+        if cache is not None:
+            cache.close()
+
+    return time.perf_counter() - start, data_parser.stats
+
+
+def _iter_chunks(chunks: multiprocessing.Queue, future: Future) -> Iterator[list[EmailRecord]]:
+    """
+    Chunks of an export as _extract_file() puts them, anything that went wrong in the worker is raised here
+    """
+    while True:
+        try:
+            chunk = chunks.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            # The worker puts None before it's done, so it's only done without it if it failed
+            if future.done() and chunks.empty():
+                future.result()
+                raise RuntimeError("Export worker stopped without finishing")
+            continue
+
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _duplicate_key(record: EmailRecord) -> tuple:
+    # The same email cc'd to several interns shows up in each of their inboxes
+    return (record.sender_email or "").lower() or record.sender_name, record.receive_time, record.subject
+
+
+def _is_duplicate(seen: dict[tuple, int], record: EmailRecord, export_index: int) -> bool:
+    """
+    If the message was already seen in an earlier export, seen is _duplicate_key -> index of the export it was
+    first seen in. Repeats within the same export aren't duplicates, same as when an export is matched on its own
+    """
+    return seen.setdefault(_duplicate_key(record), export_index) != export_index
+
+
+def iter_batch_emails(email_export_files: list[str], workers: int | None = None, cache_file: str | None = None,
+                      stats: list[FileStats] | None = None, options: ExtractionOptions = ExtractionOptions()) -> Iterator[EmailMessage]:
+    """
+    Decodes several exports at once, one export per process, and yields their messages in file order
+    Workers send their records back in chunks through a queue per export, so matching starts as soon as the first
+    chunk is decoded and only a few chunks per export are held at once, see CHUNK_SIZE / QUEUE_CHUNKS
+    Messages that were already seen in an earlier export are skipped, see _is_duplicate()
+    Per-file throughput is printed as every file is finished, and appended to stats if it's given
+    """
+    seen: dict[tuple, int] = {}
+    workers = min(workers or os.cpu_count() or 1, max(len(email_export_files), 1))
+
+    stop = data_parser.WORKER_CONTEXT.Event()
+    queues = [data_parser.WORKER_CONTEXT.Queue(QUEUE_CHUNKS) for _ in email_export_files]
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=data_parser.WORKER_CONTEXT, initializer=_init_worker,
+                               initargs=(queues, stop))
+    try:
+        futures = [pool.submit(_extract_file, i, export_index, cache_file, options)
+                   for export_index, i in enumerate(email_export_files)]
+
+        for export_index, (email_export_file, chunks, future) in enumerate(zip(email_export_files, queues, futures)):
+            messages = duplicates = 0
+            source = os.path.basename(email_export_file)
+
+            for records in _iter_chunks(chunks, future):
+                messages += len(records)
+
+                for record in records:
+                    if _is_duplicate(seen, record, export_index):
+                        duplicates += 1
+                        continue
+
+                    msg = EmailMessage.from_record(record)
+                    msg.source = source
+                    yield msg
+
+            seconds, worker_stats = future.result()
+            data_parser.stats.merge(worker_stats)
+
+            file_stats = FileStats(email_export_file, messages, duplicates, seconds)
+            print(file_stats)
+
+            if stats is not None:
+                stats.append(file_stats)
+    finally:
+        # Workers waiting on a full queue give up, the ones that haven't started never do
+        stop.set()
+        pool.shutdown(cancel_futures=True)
+        for i in queues:
+            i.close()
+
+
+def iter_new_batch_emails(email_export_files: list[str], checkpoint: Checkpoint, inbox_names: dict[str, str] | None = None,
+                          options: ExtractionOptions = ExtractionOptions()) -> Iterator[EmailMessage]:
+    """
+    Messages of every export that weren't processed by a previous run, see data_parser.iter_new_emails()
+    Exports are read one after another, and messages already seen in an earlier export are skipped like
+    iter_batch_emails() does, so both count the same mail
+    """
+    seen: dict[tuple, int] = {}
+
+    for export_index, email_export_file in enumerate(email_export_files):
+        export_key = Checkpoint.export_key(email_export_file, inbox_names)
+        duplicates = 0
+
+        for msg in data_parser.iter_new_emails(email_export_file, checkpoint, export_key, options):
+            if _is_duplicate(seen, msg.to_record(), export_index):
+                duplicates += 1
+                continue
+
+            yield msg
+
+        if duplicates:
+            print(f"{os.path.basename(email_export_file)}: skipped {duplicates:,} duplicates of earlier exports")
+
+
+def compile_batch(manager: data_parser.TrackerManager, path: str, workers: int | None = None,
+                  cache_file: str | None = None, options: ExtractionOptions = ExtractionOptions()) -> set[tuple[str, str]]:
+    """
+    Matches every export in a directory / glob into the manager, gives back the unknown emails like compile_emails()
+    """
+    email_export_files = find_exports(path)
+    if not email_export_files:
+        print("Could not find any .pst files")
+        return set()
+
+    stats = []
+    start = time.perf_counter()
+    unknown = manager.compile_emails_stream(iter_batch_emails(email_export_files, workers, cache_file, stats, options))
+    seconds = time.perf_counter() - start
+
+    messages = sum(i.messages for i in stats)
+    print(f"{len(stats)} files, {messages:,} messages in {seconds:.1f}s, {messages / seconds if seconds else 0:,.0f} msg/s")
+
+    return unknown
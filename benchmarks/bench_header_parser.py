@@ -0,0 +1,144 @@
+"""
+Micro-benchmark for header_parser.parse_sender against the regexes EmailMessage used to run
+The samples are short, real Exchange transport headers are a few KB of Received / ARC / DKIM / X-MS-Exchange
+fields, so it's also timed on a corpus made by padding every sample with fields taken from the others
+
+Run with `python benchmarks/bench_header_parser.py [--iterations 20000] [--corpus 2000] [--seed 0]`
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import header_parser
+
+SAMPLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "header_samples.txt")
+
+_FIELD_END = re.compile(r"\r\n(?![ \t])")
+# The old regex fixed to only match a From: that starts a line, in any case, with its continuation lines
+_FIXED_FROM = re.compile(r"^from:[ \t]*(.*(?:\r?\n[ \t].*)*)", re.IGNORECASE | re.MULTILINE)
+
+
+def load_samples() -> list[str]:
+    """
+    Samples are separated by `%%` lines, we convert to CRLF since that's what pypff gives us
+    """
+    with open(SAMPLES_FILE, encoding="utf-8") as f:
+        return [i.strip("\n").replace("\n", "\r\n") + "\r\n" for i in f.read().split("%%\n")]
+
+
+def build_corpus(samples: list[str], count: int, rng: random.Random) -> list[tuple[str, str]]:
+    """
+    Every header is one of the samples with 0-25 long fields from the others put in before its From: and 0-15
+    after it, which gives 1-10KB like real ones. Its From: / Message-ID stay the same, so it parses the same
+    Gives back (sample, padded header) pairs
+    """
+    fields = [field for headers in samples for field in _FIELD_END.split(headers) if field]
+    padding = [i for i in fields if len(i) > 40 and i.split(":")[0].lower() not in ("from", "x-original-from", "message-id")]
+
+    corpus = []
+    for _ in range(count):
+        sample = rng.choice(samples)
+        own = [i for i in _FIELD_END.split(sample) if i]
+        at = next((i for i, field in enumerate(own) if field.lower().startswith("from:")), len(own))
+
+        before = [rng.choice(padding) for _ in range(rng.randrange(26))]
+        after = [rng.choice(padding) for _ in range(rng.randrange(16))]
+        corpus.append((sample, "\r\n".join(own[:at] + before + own[at:] + after) + "\r\n"))
+
+    return corpus
+
+
+def old_sender_email(transport_headers: str | None) -> str | None:
+    """
+    The original uncompiled two regex version from EmailMessage.__init__
+    """
+    if match := re.search(r"From: (.+? )?<(.+?)>", transport_headers or ""):
+        return match.group(2)
+    elif match := re.search(r"From: ([^ ]+?@[^ ]+?\.[^ ]+?)", transport_headers or ""):
+        return match.group(1)
+
+    return None
+
+
+def fixed_sender_email(transport_headers: str | None) -> str | None:
+    """
+    Gives the same email as header_parser.parse_sender_email, but finds the field with one regex
+    """
+    if match := _FIXED_FROM.search(transport_headers or ""):
+        value = header_parser._FOLDING.sub(" ", match.group(1)).strip()
+        return header_parser._split_sender(value)[1] if value else None
+
+    return None
+
+
+def new_sender(transport_headers: str | None) -> tuple[str | None, str | None]:
+    return header_parser.parse_sender(transport_headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000, help="times every sample is parsed")
+    parser.add_argument("--corpus", type=int, default=2000, help="padded headers to time on")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    iterations = args.iterations
+    samples = load_samples()
+
+    print(f"{len(samples)} samples, {sum(map(len, samples)) / len(samples):.0f} chars on average")
+    print()
+
+    for headers in samples:
+        name, email = header_parser.parse_sender(headers)
+        print(f"old: {old_sender_email(headers)!s:45} new: {email!s:45} name: {name}")
+    print()
+
+    # parse_sender also decodes the display name which the old regex never did, so it's timed separately
+    funcs = (
+        ("old regex", old_sender_email),
+        ("fixed regex", fixed_sender_email),
+        ("email only", header_parser.parse_sender_email),
+        ("name + email", new_sender),
+    )
+
+    print(f"{'':8}" + "".join(f"{label:>15}" for label, _ in funcs))
+    totals = [0.0 for _ in funcs]
+
+    for i, headers in enumerate(samples):
+        row = []
+        for j, (_, func) in enumerate(funcs):
+            seconds = timeit.timeit(lambda: func(headers), number=iterations)
+            totals[j] += seconds
+            row.append(seconds / iterations * 1e6)
+
+        print(f"{f'#{i}':8}" + "".join(f"{us:13.2f}us" for us in row))
+
+    print(f"{'mean':8}" + "".join(f"{i / (iterations * len(samples)) * 1e6:13.2f}us" for i in totals))
+
+    pairs = build_corpus(samples, args.corpus, random.Random(args.seed))
+    if any(header_parser.parse_sender(sample) != header_parser.parse_sender(headers) for sample, headers in pairs):
+        sys.exit("Padding changed what a header parses to")
+    corpus = [headers for _, headers in pairs]
+    if any(fixed_sender_email(i) != header_parser.parse_sender_email(i) for i in corpus):
+        sys.exit("The fixed regex doesn't give the same emails as header_parser")
+    # The old regex is quick to give the wrong sender on some of them (ie. X-Original-From:), so they're also timed
+    # without those
+    agreeing = [i for i in corpus if old_sender_email(i) == header_parser.parse_sender_email(i)]
+
+    for label, headers in (("corpus", corpus), ("same", agreeing)):
+        # Best of 5, the headers are parsed about as many times as the samples were
+        number = max(1, iterations * len(samples) // len(headers))
+        row = [min(timeit.repeat(lambda: [func(i) for i in headers], number=number, repeat=5)) / (number * len(headers)) * 1e6
+               for _, func in funcs]
+
+        print(f"{label:8}" + "".join(f"{us:13.2f}us" for us in row)
+              + f"   ({len(headers)} headers, {sum(map(len, headers)) / len(headers):.0f} chars on average)")
+
+
+if __name__ == "__main__":
+    main()
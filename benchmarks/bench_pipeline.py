@@ -0,0 +1,216 @@
+"""
+Benchmarks the matching / reporting pipeline on synthetic data, so it can be run without real student data
+Generates a tracker csv, mapping json, blacklist and messages of the given sizes, times every stage and prints
+the results (seconds, throughput and peak memory per stage) as JSON
+
+Run with `python benchmarks/bench_pipeline.py --people 5000 --messages 100000`
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_parser
+from data_parser import EmailMessage, EmailRecord
+
+FIRST_NAMES = ["Alex", "Jordan", "Sam", "Taylor", "Morgan", "Casey", "Jamie", "Riley", "Avery", "Quinn", "Minh", "Léa", "Priya", "Wei"]
+LAST_NAMES = ["Smith", "Nguyen", "Li", "Patel", "Brown", "Wang", "Tremblay", "Kim", "Singh", "Martin", "Chen", "Roy"]
+
+START_DATE = datetime.date(2024, 5, 22)
+NUM_WEEKS = 12
+
+HTML_BODY = """<div dir="ltr">Hi,<br><br>I had a question about {topic}, could you let me know when I can book an appointment?
+<br><br>Thanks,<br>{name}</div><br><div class="gmail_quote"><div dir="ltr" class="gmail_attr">On Mon, May 27, 2024 at 9:00 AM
+Arrive Ready wrote:<br></div><blockquote class="gmail_quote" style="margin:0px 0px 0px 0.8ex">Hello! Thanks for reaching out
+{quoted}</blockquote></div>"""
+
+
+def generate_tracker(file: str, people: int, rng: random.Random) -> list[tuple[str, str, str, str]]:
+    """
+    Writes a tracker csv in the same layout as the Sharepoint export, gives back (first, preferred, last, email) per row
+    """
+    rows = []
+
+    with open(file, "w", newline="", encoding="latin-1", errors="replace") as f:
+        writer = csv.writer(f)
+        writer.writerow(("First Name", "Preferred Name", "Last Name", "Email Contact", "Email", "Attended One-on-One", "Attended Webinar", "Hidden", "Notes"))
+
+        for i in range(people):
+            first, last = rng.choice(FIRST_NAMES), f"{rng.choice(LAST_NAMES)}{i // 50}"
+            preferred = rng.choice(("", "", first, rng.choice(FIRST_NAMES)))
+            email = f"{first.lower()}.{last.lower()}{i}@mail.utoronto.ca"
+            notes = f"personal email {first.lower()}{i}@gmail.com" if rng.random() < 0.2 else ""
+
+            writer.writerow((first, preferred, last, email, "", "", "", "", notes))
+            rows.append((first, preferred, last, email))
+
+    return rows
+
+
+def generate_mapping(file: str, rows: list[tuple[str, str, str, str]], mappings: int, rng: random.Random):
+    data = {}
+    for i in range(mappings):
+        recv = f"mapped{i}@gmail.com"
+        # Some mappings chain to another mapped email instead of straight to the tracker
+        target = f"mapped{rng.randrange(i)}@gmail.com" if i and rng.random() < 0.1 else rng.choice(rows)[3]
+        data[recv] = {"name": "", "map_email": target}
+
+    with open(file, "w", encoding="latin-1") as f:
+        json.dump(data, f)
+
+
+def generate_blacklist(file: str, blacklisted: int):
+    with open(file, "w", encoding="latin-1") as f:
+        f.write("\n".join(f"noreply{i}@utoronto.ca" for i in range(blacklisted)))
+
+
+def generate_records(rows: list[tuple[str, str, str, str]], messages: int, mappings: int, blacklisted: int, rng: random.Random) -> list[EmailRecord]:
+    """
+    Messages from a mix of tracker emails, mapped emails, name-only matches, blacklisted and unknown senders
+    Senders repeat a lot like in a real inbox
+    """
+    start = int(datetime.datetime.combine(START_DATE, datetime.time(), tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    senders = []
+
+    for _ in range(max(messages // 20, 1)):
+        kind = rng.random()
+        first, preferred, last, email = rng.choice(rows)
+
+        if kind < 0.5:
+            senders.append((f"{first} {last}", email))
+        elif kind < 0.65 and mappings:
+            senders.append((f"{first} {last}", f"mapped{rng.randrange(mappings)}@gmail.com"))
+        elif kind < 0.8:
+            senders.append((f"{preferred or first} {last}", f"{first.lower()}{rng.randrange(10 ** 6)}@yahoo.com"))
+        elif kind < 0.9 and blacklisted:
+            senders.append(("No Reply", f"noreply{rng.randrange(blacklisted)}@utoronto.ca"))
+        else:
+            senders.append((f"Unknown {rng.randrange(10 ** 6)}", f"unknown{rng.randrange(10 ** 6)}@example.com"))
+
+    return [
+        EmailRecord(name, email, start + rng.randrange(NUM_WEEKS * 7 * 86400000), f"Subject {i}")
+        for i, (name, email) in enumerate(rng.choice(senders) for _ in range(messages))
+    ]
+
+
+class Stages:
+    """
+    Times stages and tracks their peak memory
+    """
+
+    def __init__(self, track_memory: bool):
+        self.track_memory = track_memory
+        self.results = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items: int):
+        if self.track_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        # The pipeline prints for every ambiguous / unknown message, that's not what we're timing
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        seconds = time.perf_counter() - start
+
+        self.results[name] = {
+            "items": items,
+            "seconds": round(seconds, 6),
+            "items_per_second": round(items / seconds, 1) if seconds else None,
+        }
+
+        if self.track_memory:
+            self.results[name]["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1] - base
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--people", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--mappings", type=int, default=1000)
+    parser.add_argument("--blacklisted", type=int, default=50)
+    parser.add_argument("--html", type=int, default=2000, help="number of bodies to run through parse_html")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fuzzy", action="store_true", help="turn on fuzzy name matching")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows everything down")
+    parser.add_argument("--output", help="write the JSON here instead of printing it")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stages = Stages(not args.no_memory)
+
+    with tempfile.TemporaryDirectory() as directory:
+        tracker_file = os.path.join(directory, "tracker.csv")
+        mapping_file = os.path.join(directory, "email_mappings.json")
+        blacklist_file = os.path.join(directory, "blacklist.txt")
+
+        rows = generate_tracker(tracker_file, args.people, rng)
+        generate_mapping(mapping_file, rows, args.mappings, rng)
+        generate_blacklist(blacklist_file, args.blacklisted)
+        records = generate_records(rows, args.messages, args.mappings, args.blacklisted, rng)
+        bodies = [
+            HTML_BODY.format(topic=f"course {i}", name=rng.choice(FIRST_NAMES), quoted="previous message " * 20).encode("latin-1")
+            for i in range(args.html)
+        ]
+
+        if stages.track_memory:
+            tracemalloc.start()
+
+        manager = data_parser.TrackerManager(add_dummy=True, fuzzy_match=args.fuzzy)
+
+        with stages.stage("load_tracker_csv", args.people):
+            manager.load_tracker_csv(tracker_file)
+        with stages.stage("load_email_mapping", args.mappings):
+            manager.load_email_mapping(mapping_file)
+        with stages.stage("load_email_blacklist", args.blacklisted):
+            manager.load_email_blacklist(blacklist_file)
+
+        with stages.stage("from_record", len(records)):
+            messages = [EmailMessage.from_record(i) for i in records]
+        with stages.stage("_find_matching_person", len(messages)):
+            for m in messages:
+                manager._find_matching_person(m)
+        if args.fuzzy:
+            with stages.stage("find_fuzzy_name_matches", len(messages)):
+                for m in messages:
+                    manager.match_index.find_fuzzy_name_matches(m)
+        with stages.stage("compile_emails", len(messages)):
+            manager.compile_emails_stream(messages)
+
+        with stages.stage("extract_weekly_emails", len(manager.messages)):
+            manager.extract_weekly_emails(START_DATE, NUM_WEEKS)
+        with stages.stage("extract_total_emails", len(manager.people)):
+            manager.extract_total_emails()
+
+        with stages.stage("parse_html", len(bodies)):
+            for body in bodies:
+                EmailMessage.parse_html(body)
+
+        if stages.track_memory:
+            tracemalloc.stop()
+
+    report = {
+        "config": {i: j for i, j in vars(args).items() if i != "output"},
+        "stages": stages.results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Checks that body_parser.parse_html gives the same text as the BeautifulSoup version EmailMessage used to run,
+on the samples in body_samples.txt, and on random markup built from pieces of them with --fuzz
+Also times both, needs beautifulsoup4 installed
+
+Run with `python benchmarks/check_body_parser.py [--fuzz 10000] [--seed 0]`
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import body_parser
+
+SAMPLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "body_samples.txt")
+
+
+def load_samples() -> list[bytes]:
+    """
+    Samples are separated by `%%` lines, pypff gives us bytes so they're encoded like it does
+    """
+    with open(SAMPLES_FILE, encoding="utf-8") as f:
+        return [i.encode("utf-8") for i in f.read().split("%%\n")]
+
+
+def old_parse_html(html):
+    """
+    The original BeautifulSoup version of EmailMessage.parse_html
+    """
+    # Jank way of removing gmail quotes
+    parsed_html = BeautifulSoup((html or b"").decode("latin-1").strip().split("<hr")[0].split("---- Replied Message ----")[0], "html.parser")
+
+    to_remove = [
+        ("div", {"class": "gmail_quote"}),
+        ("div", {"id": "mail-editor-reference-message-container"}),
+        ("blockquote", {"id": "isReplyContent"}),
+        ("blockquote", {"type": "cite"}),
+    ]
+
+    for tag, atr in to_remove:
+        for elem in parsed_html.find_all(tag, atr):
+            elem.decompose()
+
+    return re.sub("\n\\s+", "\n", parsed_html.get_text()).strip()
+
+
+def fuzz_samples(samples: list[bytes], count: int, rng: random.Random) -> list[bytes]:
+    """
+    Random soups of tags / text / entities cut out of the samples, to catch odd nesting and broken markup
+    """
+    pieces = sorted({i for sample in samples for i in re.findall(rb"<[^<>]*>|&#?\w+;?|[^<&]+", sample)})
+    return [b"".join(rng.choice(pieces) for _ in range(rng.randrange(1, 60))) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=0, help="number of random documents to check as well")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    samples = load_samples()
+    documents = samples + fuzz_samples(samples, args.fuzz, random.Random(args.seed))
+
+    mismatches = 0
+    for html in documents:
+        if (old := old_parse_html(html)) != (new := body_parser.parse_html(html)):
+            mismatches += 1
+            print(f"mismatch for {html[:200]!r}\n  old: {old!r}\n  new: {new!r}")
+
+    print(f"{len(documents) - mismatches}/{len(documents)} documents match")
+    print()
+
+    for i, html in enumerate(samples):
+        old = timeit.timeit(lambda: old_parse_html(html), number=args.iterations) / args.iterations
+        new = timeit.timeit(lambda: body_parser.parse_html(html), number=args.iterations) / args.iterations
+        print(f"sample {i:2}: {len(html):6,} bytes  old: {old * 1e6:8.1f}us  new: {new * 1e6:8.1f}us  {old / new:4.1f}x")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Checks that mail cc'd to several inboxes is only counted once, the same with and without --incremental
+Makes two exports that share most of their messages (plus some of their own, and a few repeats inside one inbox)
+and runs `cli.py match` + `cli.py report` on them both ways. The exports aren't real .pst files, the normal run
+reads them from a pre-filled extraction cache and the incremental run through a stand-in for PffArchive
+
+Run with `python benchmarks/check_duplicates.py [--shared 1800] [--seed 0]`
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli
+import data_parser
+from bench_pipeline import generate_records, generate_tracker
+from data_parser import EmailRecord, ExtractionOptions
+from extraction_cache import ExtractionCache
+
+
+class FakeMessage:
+    """
+    The parts of a pypff.message EmailMessage reads
+    """
+
+    def __init__(self, record: EmailRecord, message_id: str):
+        self.sender_name = record.sender_name
+        self.subject = record.subject
+        self.transport_headers = f"From: {record.sender_name} <{record.sender_email}>\r\nMessage-ID: <{message_id}>\r\n"
+        self._delivery_time = datetime.datetime.fromtimestamp(record.receive_time / 1000, datetime.timezone.utc)
+
+    def get_delivery_time(self) -> datetime.datetime:
+        return self._delivery_time
+
+
+class FakeFolder:
+    def __init__(self, name: str | None, messages: list[FakeMessage], sub_folders: list['FakeFolder'] = ()):
+        self.name = name
+        self.sub_messages = messages
+        self.number_of_sub_messages = len(messages)
+        self.sub_folders = list(sub_folders)
+
+
+def make_exports(folder: str, shared: int, rng: random.Random) -> dict[str, list[tuple[EmailRecord, str]]]:
+    """
+    (record, Message-ID) of every message in two exports, most of them in both
+    """
+    rows = generate_tracker(os.path.join(folder, "tracker.csv"), 500, rng)
+    records = generate_records(rows, shared + 400, 0, 0, rng)
+    messages = [(record, f"{i}@check") for i, record in enumerate(records)]
+
+    exports = {
+        os.path.join(folder, "exports", "alex.pst"): messages[:shared] + messages[shared:shared + 200],
+        os.path.join(folder, "exports", "sam.pst"): messages[:shared] + messages[shared + 200:],
+    }
+    # The same message twice in one inbox is kept, only copies in other inboxes are dropped
+    first = exports[os.path.join(folder, "exports", "alex.pst")]
+    first.extend(first[:50])
+
+    return exports
+
+
+def fill_cache(cache_file: str, exports: dict[str, list[tuple[EmailRecord, str]]]):
+    cache = ExtractionCache(cache_file)
+    for export, messages in exports.items():
+        writer = cache.writer(export, ExtractionOptions().cache_key())
+        for record, message_id in messages:
+            writer.add(record.sender_name, record.sender_email, record.receive_time, record.subject)
+        writer.finish()
+    cache.close()
+
+
+def run(config_file: str, folder: str, name: str, *args: str) -> tuple[int, list[list[str]]]:
+    """
+    Emails counted in the weekly report (unmatched ones too) and the rows of the total report
+    """
+    weekly_file, total_file = os.path.join(folder, f"{name}_weekly.txt"), os.path.join(folder, f"{name}_total.csv")
+    with contextlib.redirect_stdout(io.StringIO()):
+        cli.main(["--config", config_file, "match", *args])
+        cli.main(["--config", config_file, "report", "--weekly-file", weekly_file, "--total-file", total_file, *args])
+
+    with open(weekly_file) as f:
+        count = sum(map(int, f.read().split()))
+    with open(total_file, newline="") as f:
+        rows = list(csv.reader(f))[1:]
+
+    return count, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shared", type=int, default=1800, help="messages that are in both exports")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, "exports"))
+        exports = make_exports(folder, args.shared, random.Random(args.seed))
+
+        for export, messages in exports.items():
+            with open(export, "w") as f:
+                f.write(export)
+
+        # Normal runs decode in worker processes, which read the exports from the cache
+        fill_cache(os.path.join(folder, "cache.sqlite3"), exports)
+
+        # Incremental runs read in this process
+        archives = {
+            os.path.abspath(export): FakeFolder(None, [], [FakeFolder("Inbox", [FakeMessage(*i) for i in messages])])
+            for export, messages in exports.items()
+        }
+        data_parser._open_archive = lambda file: type("FakeArchive", (), {"folders": lambda self: iter([archives[file]])})()
+
+        config_file = os.path.join(folder, "config.json")
+        with open(config_file, "w") as f:
+            json.dump({
+                "files": {
+                    "trackers": [os.path.join(folder, "tracker.csv")],
+                    "email_mapping": "",
+                    "blacklist": "",
+                    "exports": os.path.join(folder, "exports"),
+                    "cache": os.path.join(folder, "cache.sqlite3"),
+                    "results": os.path.join(folder, "results.sqlite3"),
+                    "skipped_emails": "",
+                    "run_stats": "",
+                    "checkpoint": os.path.join(folder, "checkpoint.json"),
+                },
+                # Unmatched emails are counted too, so every email shows up in the weekly report
+                "match": {"count_unmatched": True},
+            }, f)
+
+        expected = len({(record.sender_email, record.receive_time, record.subject) for messages in exports.values() for record, _ in messages}) + 50
+        full_count, full_rows = run(config_file, folder, "full")
+        incremental_count, incremental_rows = run(config_file, folder, "incremental", "--incremental")
+        # A second incremental run has nothing new to add
+        again_count, _ = run(config_file, folder, "again", "--incremental")
+
+    print(f"expected {expected:,}, match {full_count:,}, match --incremental {incremental_count:,}, again {again_count:,}")
+    print("same totals per person:", full_rows == incremental_rows)
+
+    if not expected == full_count == incremental_count == again_count or full_rows != incremental_rows:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
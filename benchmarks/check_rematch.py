@@ -0,0 +1,92 @@
+"""
+Checks that loading mappings / a blacklist after a run moves the messages already matched, and gives back the right
+senders for the unknown emails: the ones that match now are taken out, and the ones that don't match anymore (ie. a
+sender remapped to someone else, who shares it with the person it was mapped to first) are added back
+Every step is compared with a manager that had the same files loaded before the run
+
+Run with `python benchmarks/check_rematch.py`
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_parser
+from data_parser import EmailMessage, EmailRecord
+
+PEOPLE = [("Ann", "", "Lee", "ann.lee@mail.utoronto.ca"), ("Bob", "", "Roy", "bob.roy@mail.utoronto.ca")]
+SENDER = ("Student X", "studentx@gmail.com")
+MESSAGES = [EmailRecord(*SENDER, 1716800000000 + i * 3600000) for i in range(3)] + [
+    EmailRecord("Ann Lee", "ann.lee@mail.utoronto.ca", 1716800000000),
+]
+
+
+def write_files(folder: str) -> dict[str, str]:
+    files = {
+        "tracker": os.path.join(folder, "tracker.csv"),
+        "to_bob": os.path.join(folder, "to_bob.json"),
+        "to_ann": os.path.join(folder, "to_ann.json"),
+        "blacklist": os.path.join(folder, "blacklist.txt"),
+    }
+
+    with open(files["tracker"], "w", newline="") as f:
+        f.write("First Name,Preferred Name,Last Name,Email Contact\n")
+        f.writelines(",".join(i) + "\n" for i in PEOPLE)
+    for name, email in (("to_bob", PEOPLE[1][3]), ("to_ann", PEOPLE[0][3])):
+        with open(files[name], "w") as f:
+            json.dump({SENDER[1]: {"name": SENDER[0], "map_email": email}}, f)
+    with open(files["blacklist"], "w") as f:
+        f.write(SENDER[1])
+
+    return files
+
+
+def load(manager: data_parser.TrackerManager, files: dict[str, str], step: str) -> data_parser.Rematched:
+    if step == "blacklist":
+        return manager.load_email_blacklist(files["blacklist"])
+    return manager.load_email_mapping(files[step])
+
+
+def counts(manager: data_parser.TrackerManager) -> list[int]:
+    return manager.messages.counts(len(manager.people)).tolist()
+
+
+def main():
+    failed = False
+
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        files = write_files(folder)
+
+        manager = data_parser.TrackerManager(add_dummy=True)
+        manager.load_trackers([files["tracker"]])
+        # Kept up to date like the GUI does between runs
+        unknown = manager.compile_emails([EmailMessage.from_record(i) for i in MESSAGES])
+
+        done = []
+        for step, expected_unknown in (("to_bob", set()), ("to_ann", {SENDER}), ("blacklist", set())):
+            rematched = load(manager, files, step)
+            unknown = (unknown - rematched.resolved) | rematched.unresolved
+            done.append(step)
+
+            # The same files loaded before the run
+            fresh = data_parser.TrackerManager(add_dummy=True)
+            fresh.load_trackers([files["tracker"]])
+            for i in done:
+                load(fresh, files, i)
+            fresh_unknown = fresh.compile_emails([EmailMessage.from_record(i) for i in MESSAGES])
+
+            ok = unknown == expected_unknown == fresh_unknown and counts(manager) == counts(fresh)
+            failed |= not ok
+            print(f"{step}: unknown {sorted(unknown)}, counts {counts(manager)}, loaded first {counts(fresh)}, "
+                  f"{'ok' if ok else 'WRONG'}", file=sys.stderr)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import re
+from html.entities import html5
+from html.parser import HTMLParser
+
+# Containers of quoted replies, (tag, attribute, value), they're dropped along with everything inside them
+# For class, any of the element's classes can match
+QUOTE_CONTAINERS = (
+    ("div", "class", "gmail_quote"),
+    ("div", "id", "mail-editor-reference-message-container"),
+    ("blockquote", "id", "isReplyContent"),
+    ("blockquote", "type", "cite"),
+)
+
+_QUOTE_CONTAINER_TAGS = frozenset(i[0] for i in QUOTE_CONTAINERS)
+
+# Tags that never have content, they're closed as soon as they're opened
+VOID_TAGS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param", "source",
+    "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer",
+))
+
+# Text inside these isn't part of the body
+NON_TEXT_TAGS = frozenset(("script", "style", "template", "rt", "rp"))
+
+# Whitespace in these is kept as is
+PRESERVE_WHITESPACE_TAGS = frozenset(("pre", "textarea"))
+
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# Named entities without their semicolon, the first one alphabetically wins when they differ
+ENTITIES: dict[str, str] = {}
+for _name, _character in sorted(html5.items()):
+    ENTITIES.setdefault(_name[:-1] if _name.endswith(";") else _name, _character)
+
+_WHITESPACE_AFTER_NEWLINE = re.compile("\n\\s+")
+
+
+def _is_quote_container(tag: str, attrs: list[tuple[str, str | None]]) -> bool:
+    checks = [i for i in QUOTE_CONTAINERS if i[0] == tag]
+
+    # Last one wins if an attribute shows up twice
+    attr_dict = {i: j or "" for i, j in attrs}
+
+    for _, attr, value in checks:
+        if attr not in attr_dict:
+            continue
+        elif attr_dict[attr] == value:
+            return True
+        elif attr == "class" and value in attr_dict[attr].split():
+            return True
+
+    return False
+
+
+class BodyParser(HTMLParser):
+    """
+    Turns an email's html into text in one pass, without building a tree
+    Quoted replies are skipped as they're parsed, along with scripts / styles
+
+    Gives the same text as parsing with BeautifulSoup("html.parser"), decomposing the quote containers and
+    calling get_text(), including how it handles whitespace-only strings and entities
+    """
+
+    def __init__(self):
+        # Entities are converted by us, the same way BeautifulSoup does it
+        super().__init__(convert_charrefs=False)
+
+        # Open tags
+        self.stack: list[str] = []
+        # Void tags that were closed for us, so their explicit end tag (if there is one) is ignored
+        self.already_closed: list[str] = []
+        # Depth of the stack when each skipped subtree started
+        self.skip_depths: list[int] = []
+        self.non_text_depth = 0
+        self.preserve_depth = 0
+
+        self.pending: list[str] = []
+        self.text: list[str] = []
+
+    def _end_data(self, cdata: bool = False):
+        """
+        Everything between two tags is one string, BeautifulSoup shrinks it to a single space / newline
+        if it's only whitespace
+        """
+        if not self.pending:
+            return
+
+        data = "".join(self.pending)
+        self.pending = []
+
+        # BeautifulSoup keeps CDATA sections even in scripts / styles
+        if self.skip_depths or (self.non_text_depth and not cdata):
+            return
+
+        if not self.preserve_depth and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+
+        self.text.append(data)
+
+    def _open(self, tag: str, attrs: list[tuple[str, str | None]]):
+        self._end_data()
+
+        if tag in _QUOTE_CONTAINER_TAGS and _is_quote_container(tag, attrs):
+            self.skip_depths.append(len(self.stack))
+
+        self.stack.append(tag)
+        self.non_text_depth += tag in NON_TEXT_TAGS
+        self.preserve_depth += tag in PRESERVE_WHITESPACE_TAGS
+
+    def _close(self, tag: str):
+        self._end_data()
+
+        # End tags without a matching open tag are ignored, otherwise everything up to the matching tag is closed
+        if tag not in self.stack:
+            return
+
+        while self.stack:
+            closed = self.stack.pop()
+            self.non_text_depth -= closed in NON_TEXT_TAGS
+            self.preserve_depth -= closed in PRESERVE_WHITESPACE_TAGS
+
+            if self.skip_depths and self.skip_depths[-1] == len(self.stack):
+                self.skip_depths.pop()
+
+            if closed == tag:
+                break
+
+    # The bookkeeping for void tags is odd, but it's what BeautifulSoup does. ie. with <br> <br/> </br>,
+    # the </br> is taken as the end of the first <br>, which leaves the second one open
+
+    def handle_starttag(self, tag, attrs):
+        self._open(tag, attrs)
+
+        if tag in VOID_TAGS:
+            self._close(tag)
+            self.already_closed.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._open(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Doesn't end the current string either
+        if tag in self.already_closed:
+            self.already_closed.remove(tag)
+        else:
+            self._close(tag)
+
+    def handle_data(self, data):
+        self.pending.append(data)
+
+    def handle_charref(self, name):
+        number = int(name[1:], 16) if name[:1] in "xX" else int(name)
+
+        data = None
+        # Low numbers are usually windows-1252 instead of unicode (ie. &#147; for a quote)
+        if number < 256:
+            try:
+                data = bytes((number,)).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(number)
+            except (ValueError, OverflowError):
+                pass
+
+        self.pending.append(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        self.pending.append(ENTITIES.get(name, "&" + name))
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+
+        # CDATA sections are text, other declarations aren't
+        if data.upper().startswith("CDATA["):
+            self.pending.append(data[len("CDATA["):])
+            self._end_data(cdata=True)
+
+    def close(self):
+        super().close()
+        self._end_data()
+
+
+def parse_html(html: bytes | None) -> str:
+    """
+    Text of an email's html body without the quoted replies under it
+    """
+    # Jank way of removing quotes that aren't in a container
+    html = (html or b"").decode("latin-1").strip().split("<hr")[0].split("---- Replied Message ----")[0]
+
+    parser = BodyParser()
+    parser.feed(html)
+    parser.close()
+
+    return _WHITESPACE_AFTER_NEWLINE.sub("\n", "".join(parser.text)).strip()
@@ -0,0 +1,139 @@
+import fnmatch
+import json
+import os
+import re
+
+# Dates / times people stamp exports with, ie. `chris_2024-06-01.pst` or `chris 20240601-0900.pst`
+_EXPORT_STAMP = re.compile(r"[ _.-]*\d{4}[-_.]?\d{2}[-_.]?\d{2}(?:[T _.-]?\d{2}[-_.]?\d{2}(?:[-_.]?\d{2})?)?")
+
+
+class Checkpoint:
+    """
+    Keeps track of what's already been processed so weekly re-exports only need to process new mail
+    For every export / folder we store the latest delivery time seen plus the Message-IDs at that time
+    (so messages delivered in the same millisecond aren't skipped), along with running totals of every
+    message counted so far
+    Mail that's already counted is never matched again, so the checkpoint also keeps a fingerprint of the trackers,
+    mappings and blacklist it was counted with, see matches()
+    """
+
+    def __init__(self):
+        # {export_key: {folder_path: (receive_time, {message_id, ...})}}
+        self.marks: dict[str, dict[str, tuple[int, set[str]]]] = {}
+
+        # Running totals, (first name, preferred name, last name, tracker email) -> count and day since epoch -> count
+        self.person_counts: dict[tuple[str, str, str, str], int] = {}
+        self.day_counts: dict[int, int] = {}
+
+        # TrackerManager.checkpoint_fingerprint() of what the totals were matched with, None for a new checkpoint
+        self.fingerprint: str | None = None
+
+        # Marks from the current run, only applied once the run's results are merged in
+        self._pending_marks: dict[tuple[str, str], tuple[int, set[str]]] = {}
+
+    @classmethod
+    def load(cls, checkpoint_file: str) -> 'Checkpoint':
+        """
+        Loads a checkpoint, or gives back an empty one if the file doesn't exist yet
+        """
+        checkpoint = cls()
+        if not os.path.exists(checkpoint_file):
+            return checkpoint
+
+        with open(checkpoint_file, encoding="utf-8") as f:
+            data = json.load(f)
+
+        checkpoint.marks = {
+            export: {folder: (mark["time"], set(mark["ids"])) for folder, mark in folders.items()}
+            for export, folders in data["marks"].items()
+        }
+        checkpoint.person_counts = {tuple(i[:-1]): i[-1] for i in data["people"]}
+        checkpoint.day_counts = {int(i): j for i, j in data["days"].items()}
+        checkpoint.fingerprint = data.get("fingerprint")
+
+        return checkpoint
+
+    def save(self, checkpoint_file: str):
+        data = {
+            "fingerprint": self.fingerprint,
+            "marks": {
+                export: {folder: {"time": time, "ids": sorted(ids)} for folder, (time, ids) in folders.items()}
+                for export, folders in self.marks.items()
+            },
+            "people": [[*i, j] for i, j in self.person_counts.items()],
+            "days": {str(i): j for i, j in sorted(self.day_counts.items())},
+        }
+
+        # Write to a temp file first so a crash can't leave us with half a checkpoint
+        with open(checkpoint_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+    @staticmethod
+    def export_key(email_export_file: str, inbox_names: dict[str, str] | None = None) -> str:
+        """
+        What an export is known as in the checkpoint, the same for every export of the same inbox:
+        the name of the first `inbox_names` pattern (wildcards work) that matches the file name, otherwise the file
+        name with any dates taken out (ie. `chris_2024-06-01.pst` -> `chris.pst`)
+        Nothing inside a .pst stays the same across exports (a new export gets new ids), so it's worked out from the name
+        """
+        file_name = os.path.basename(email_export_file)
+        for pattern, name in (inbox_names or {}).items():
+            if fnmatch.fnmatch(file_name.lower(), pattern.lower()):
+                return name
+
+        stem, extension = os.path.splitext(file_name)
+        return (_EXPORT_STAMP.sub("", stem) or stem) + extension
+
+    def matches(self, fingerprint: str) -> bool:
+        """
+        If the totals were counted with the same trackers / mappings / blacklist, a new checkpoint matches anything
+        """
+        return self.fingerprint is None or self.fingerprint == fingerprint
+
+    def mark_time(self, export_key: str, folder_path: str) -> int:
+        """
+        Latest delivery time processed for a folder, anything before this can be skipped without decoding it
+        """
+        mark = self.marks.get(export_key, {}).get(folder_path)
+        return mark[0] if mark else -1
+
+    def is_new(self, export_key: str, folder_path: str, receive_time: int, message_id: str | None) -> bool:
+        mark = self.marks.get(export_key, {}).get(folder_path)
+        if mark is None or receive_time > mark[0]:
+            return True
+        elif receive_time < mark[0]:
+            return False
+
+        # Same time as the mark, if there's no id to go off of we assume we've seen it already
+        return message_id is not None and message_id not in mark[1]
+
+    def see(self, export_key: str, folder_path: str, receive_time: int, message_id: str | None):
+        """
+        Records a processed message, the new marks are applied with commit()
+        """
+        key = (export_key, folder_path)
+        if key not in self._pending_marks:
+            self._pending_marks[key] = self.marks.get(export_key, {}).get(folder_path, (-1, set()))
+
+        time, ids = self._pending_marks[key]
+        if receive_time > time:
+            self._pending_marks[key] = (receive_time, {message_id} if message_id else set())
+        elif receive_time == time and message_id:
+            self._pending_marks[key] = (time, ids | {message_id})
+
+    def add_totals(self, person_counts: dict[tuple[str, str, str, str], int], day_counts: dict[int, int]):
+        for i, j in person_counts.items():
+            self.person_counts[i] = self.person_counts.get(i, 0) + j
+
+        for i, j in day_counts.items():
+            self.day_counts[i] = self.day_counts.get(i, 0) + j
+
+    def commit(self):
+        """
+        Moves the marks from this run over, call this after the run's totals are added
+        """
+        for (export_key, folder_path), mark in self._pending_marks.items():
+            self.marks.setdefault(export_key, {})[folder_path] = mark
+
+        self._pending_marks = {}
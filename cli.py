@@ -0,0 +1,362 @@
+"""
+Runs the tracker without the GUI, ie. from cron on a server
+
+    python cli.py [--config config.toml] extract   decode the exports into the extraction cache
+    python cli.py [--config config.toml] match     match the exports to the trackers, writes the mappings / results
+    python cli.py [--config config.toml] report    weekly / total emails from the last match
+    python cli.py gui                              opens the GUI
+
+Paths, dates and options come from a TOML (Python 3.11+) or JSON config, see example_data/config.toml
+Without --config, config.toml or config.json in the current directory is used if there is one
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import datetime
+import json
+import os
+import sys
+
+# Same paths main.py has always used
+DEFAULT_CONFIG = {
+    "files": {
+        "trackers": ["data/mps_tracker_export.csv"],
+        "email_mapping": "data/email_mappings.json",
+        "blacklist": "data/blacklist.txt",
+        # Folder, glob or a single .pst file
+        "exports": "data/email_exports",
+        "cache": "data/extraction_cache.sqlite3",
+        "results": "data/results.sqlite3",
+        "skipped_emails": "data/skipped_emails.tsv",
+        "run_stats": "data/run_stats.json",
+        "checkpoint": "data/checkpoint.json",
+    },
+    "match": {
+        # 0 is one per CPU
+        "workers": 0,
+        "fuzzy_match": False,
+        # Counts emails that didn't match anyone in the weekly report too, like the GUI does
+        "count_unmatched": False,
+        # Only read mail that's newer than the checkpoint, the totals are kept in the checkpoint
+        "incremental": False,
+        # Names for the checkpoint to know inboxes by, by file name pattern (wildcards work), ie. {"chris_*.pst": "chris"}
+        # Exports that don't match any are known by their file name without dates, see Checkpoint.export_key()
+        "inbox_names": {},
+        # Only read the sender / time / subject of each message, not the headers or body, see pst_properties.py
+        "headers_only": False,
+        # Folders to skip along with their sub folders, by name (wildcards work), ie. ["Deleted Items", "Junk*"]
+        "skip_folders": [],
+    },
+    "report": {
+        "start_date": "2024-05-22",
+        "weeks": 12,
+        # Printed if not set
+        "weekly_file": "",
+        "total_file": "",
+    },
+}
+
+CONFIG_FILES = ("config.toml", "config.json")
+
+# Files match / extract write to, their folders are made if they aren't there yet (ie. data/ on a fresh checkout)
+OUTPUT_FILES = ("email_mapping", "cache", "results", "skipped_emails", "run_stats", "checkpoint")
+
+# Seconds between progress lines while matching
+PROGRESS_INTERVAL = 5
+
+
+def load_config(config_file: str | None = None) -> dict:
+    """
+    DEFAULT_CONFIG with everything in the config file on top of it
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+
+    if config_file is None:
+        config_file = next((i for i in CONFIG_FILES if os.path.exists(i)), None)
+        if config_file is None:
+            return config
+    elif not os.path.exists(config_file):
+        raise SystemExit(f"Could not find config file {config_file}")
+
+    if config_file.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            raise SystemExit("TOML configs need Python 3.11 or higher, use a .json config instead")
+
+        with open(config_file, "rb") as f:
+            data = tomllib.load(f)
+    elif config_file.endswith(".json"):
+        with open(config_file, encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        raise SystemExit("Inputted config file is not a .toml or .json file")
+
+    for section, values in data.items():
+        if section not in config:
+            raise SystemExit(f"Unknown config section `{section}`")
+
+        for key, value in values.items():
+            if key not in config[section]:
+                raise SystemExit(f"Unknown config option `{section}.{key}`")
+            config[section][key] = value
+
+    # A single tracker is fine too
+    if isinstance(config["files"]["trackers"], str):
+        config["files"]["trackers"] = [config["files"]["trackers"]]
+
+    return config
+
+
+def parse_start_date(value: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(str(value))
+    except ValueError:
+        raise SystemExit(f"Start date `{value}` should look like 2024-05-22")
+
+
+def make_output_folders(files: dict):
+    for key in OUTPUT_FILES:
+        if files[key] and (folder := os.path.dirname(files[key])):
+            os.makedirs(folder, exist_ok=True)
+
+
+def extraction_options(config: dict) -> 'data_parser.ExtractionOptions':
+    import data_parser
+
+    options = config["match"]
+    return data_parser.ExtractionOptions(bool(options["headers_only"]), tuple(options["skip_folders"]))
+
+
+def extract(config: dict, args: argparse.Namespace):
+    """
+    Decodes every export into the extraction cache, so match doesn't have to (ie. overnight)
+    """
+    import batch
+    import data_parser
+    import instrumentation
+
+    files = config["files"]
+    make_output_folders(files)
+    email_export_files = batch.find_exports(files["exports"])
+    if not email_export_files:
+        print("Could not find any .pst files")
+        return
+
+    messages = batch.iter_batch_emails(email_export_files, config["match"]["workers"] or None, files["cache"] or None,
+                                       options=extraction_options(config))
+    for _ in messages:
+        pass
+
+    data_parser.stats.emit(instrumentation.print_sink)
+
+
+def match(config: dict, args: argparse.Namespace):
+    """
+    Matches every export to the people in the trackers
+    Unknown emails are added to the mapping file, the results are saved for report
+    """
+    import batch
+    import data_parser
+    import instrumentation
+    from checkpoint import Checkpoint
+
+    files, options = config["files"], config["match"]
+    export_options = extraction_options(config)
+    make_output_folders(files)
+
+    manager = data_parser.TrackerManager(add_dummy=options["count_unmatched"], fuzzy_match=options["fuzzy_match"])
+    manager.load_trackers(files["trackers"])
+    if files["email_mapping"] and os.path.exists(files["email_mapping"]):
+        manager.load_email_mapping(files["email_mapping"])
+    if files["blacklist"] and os.path.exists(files["blacklist"]):
+        manager.load_email_blacklist(files["blacklist"])
+
+    # Every skipped email goes here, only a summary is printed
+    manager.diagnostics.detail_file = files["skipped_emails"] or None
+
+    if files["results"]:
+        manager.attach_result_store(data_parser.ResultStore(files["results"]))
+
+    if options["incremental"]:
+        checkpoint = Checkpoint.load(files["checkpoint"])
+        # Counted mail is never matched again, so totals from other trackers / mappings / blacklist can't be added to
+        if not checkpoint.matches(manager.checkpoint_fingerprint()):
+            print("The trackers, mappings or blacklist changed since the checkpoint was saved, starting it over")
+            checkpoint = Checkpoint()
+        manager.load_checkpoint(checkpoint)
+
+        messages = batch.iter_new_batch_emails(batch.find_exports(files["exports"]), checkpoint, options["inbox_names"], export_options)
+        unknown_emails = manager.compile_emails_stream(messages)
+    else:
+        unknown_emails = asyncio.run(match_exports(manager, batch.find_exports(files["exports"]), options["workers"] or None,
+                                                   files["cache"] or None, export_options))
+
+    if files["email_mapping"]:
+        data_parser.export_mapping(unknown_emails, files["email_mapping"])
+
+    if options["incremental"]:
+        manager.update_checkpoint(checkpoint)
+        checkpoint.save(files["checkpoint"])
+
+    if manager.result_store is not None:
+        manager.sync_result_store()
+        manager.result_store.close()
+
+    # Where the time went, also saved so runs can be compared
+    sinks = [instrumentation.print_sink]
+    if files["run_stats"]:
+        sinks.append(instrumentation.json_file_sink(files["run_stats"]))
+    manager.stats.emit(*sinks)
+
+
+async def match_exports(manager: 'data_parser.TrackerManager', email_export_files: list[str], workers: int | None,
+                        cache_file: str | None, export_options: 'data_parser.ExtractionOptions') -> set[tuple[str, str]]:
+    """
+    Matches the exports with pipeline.py, printing how far along it is every few seconds
+    """
+    import pipeline
+    from extraction_cache import ExtractionCache
+
+    if not email_export_files:
+        print("Could not find any .pst files")
+        return set()
+
+    cache = ExtractionCache(cache_file) if cache_file else None
+    events = pipeline.run(manager, email_export_files, decode_workers=workers, cache=cache, options=export_options,
+                          progress_interval=PROGRESS_INTERVAL)
+
+    try:
+        async with contextlib.aclosing(events):
+            async for event in events:
+                if isinstance(event, pipeline.Progress):
+                    print(f"{event.done:,}/{'' if event.total_exact else 'up to '}{event.total:,} messages, {event.rate:,.0f} msg/s")
+                else:
+                    rate = event.messages / event.seconds if event.seconds else 0
+                    print(f"{len(email_export_files)} files, {event.messages:,} messages in {event.seconds:.1f}s, {rate:,.0f} msg/s")
+                    return event.unknown_emails
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def report(config: dict, args: argparse.Namespace):
+    """
+    Weekly and total emails of the last match, out of the results database
+    With incremental matching, the totals are the ones kept in the checkpoint instead
+    """
+    import csv
+    import numpy as np
+
+    import data_parser
+    import histogram
+    from checkpoint import Checkpoint
+    from result_store import ResultStore
+
+    files, options = config["files"], config["report"]
+    start_date = parse_start_date(args.start_date or options["start_date"])
+    weeks = args.weeks or options["weeks"]
+
+    if not files["results"] or not os.path.exists(files["results"]):
+        raise SystemExit("Could not find the results database, run match first")
+
+    store = ResultStore(files["results"])
+    # The dummy only counts the unmatched emails for the weekly report
+    people = [i for i in store.people() if i[1:] != data_parser.TrackerManager._person_key(data_parser.TrackerManager.DUMMY)]
+
+    start = histogram.start_ms(start_date, align_to_monday=True)
+
+    if config["match"]["incremental"]:
+        checkpoint = Checkpoint.load(files["checkpoint"])
+        days = np.fromiter(checkpoint.day_counts.keys(), dtype=np.int64, count=len(checkpoint.day_counts))
+        counts = np.fromiter(checkpoint.day_counts.values(), dtype=np.int64, count=len(checkpoint.day_counts))
+        weekly = histogram.bucket(days * histogram.DAY_MS, start, histogram.WEEK_MS, weeks, counts)
+        totals = {i[0]: checkpoint.person_counts.get(i[1:], 0) for i in people}
+    else:
+        weekly = store.bucket(start, histogram.WEEK_MS, weeks)
+        totals = store.totals()
+
+    store.close()
+
+    if weekly.after:
+        # Don't count these emails since they're weird
+        print(f"{weekly.after} emails were not within bounds, skipping")
+
+    # Same files the GUI's Extract Weekly / Extract Total buttons make
+    weekly_file = args.weekly_file or options["weekly_file"]
+    if weekly_file:
+        with open(weekly_file, "w") as f:
+            f.write("\n".join(map(str, weekly.counts.tolist())))
+    else:
+        print("\n".join(map(str, weekly.counts.tolist())))
+
+    total_emails = sorted(
+        ((first, preferred, last, totals.get(i, 0)) for i, first, preferred, last, email in people),
+        key=lambda x: x[2].lower()
+    )
+
+    total_file = args.total_file or options["total_file"]
+    with (open(total_file, "w", newline="") if total_file else contextlib.nullcontext(sys.stdout)) as f:
+        writer = csv.writer(f)
+        writer.writerow(("First Name", "Preferred Name", "Last Name", "Email Count"))
+        writer.writerows(total_emails)
+
+
+def open_gui(config: dict, args: argparse.Namespace):
+    # Only imported here so the other commands work on servers without Tk
+    import gui
+
+    gui.main()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", help="TOML / JSON config file, defaults to config.toml / config.json if there is one")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = commands.add_parser("extract", help="decode the exports into the extraction cache")
+    extract_parser.add_argument("--exports", help="folder, glob or .pst file, instead of files.exports")
+    extract_parser.add_argument("--workers", type=int, help="processes to decode with, instead of match.workers")
+    extract_parser.set_defaults(run=extract)
+
+    match_parser = commands.add_parser("match", help="match the exports to the trackers")
+    match_parser.add_argument("--exports", help="folder, glob or .pst file, instead of files.exports")
+    match_parser.add_argument("--workers", type=int, help="processes to decode with, instead of match.workers")
+    match_parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=None,
+                              help="only read mail newer than the checkpoint, instead of match.incremental")
+    match_parser.add_argument("--fuzzy-match", action=argparse.BooleanOptionalAction, default=None,
+                              help="match close names too, instead of match.fuzzy_match")
+    match_parser.set_defaults(run=match)
+
+    report_parser = commands.add_parser("report", help="weekly / total emails of the last match")
+    report_parser.add_argument("--start-date", help="first day of the first week (YYYY-MM-DD), instead of report.start_date")
+    report_parser.add_argument("--weeks", type=int, help="number of weeks, instead of report.weeks")
+    report_parser.add_argument("--weekly-file", help="instead of report.weekly_file")
+    report_parser.add_argument("--total-file", help="instead of report.total_file")
+    report_parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=None,
+                               help="report the checkpoint's totals, instead of match.incremental")
+    report_parser.set_defaults(run=report)
+
+    gui_parser = commands.add_parser("gui", help="open the GUI")
+    gui_parser.set_defaults(run=open_gui)
+
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    args = build_parser().parse_args(argv)
+    config = load_config(args.config)
+
+    # Command line options win over the config
+    for option, section, key in (("exports", "files", "exports"), ("workers", "match", "workers"),
+                                 ("incremental", "match", "incremental"), ("fuzzy_match", "match", "fuzzy_match")):
+        if getattr(args, option, None) is not None:
+            config[section][key] = getattr(args, option)
+
+    args.run(config, args)
+
+
+if __name__ == "__main__":
+    main()
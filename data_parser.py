@@ -1,30 +1,72 @@
+import contextlib
 import datetime
+import fnmatch
+import hashlib
 import json
+import multiprocessing
 import re
 import os
-import csv
-
-from libratom.lib.pff import PffArchive
-import pypff
-from bs4 import BeautifulSoup
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, NamedTuple
+
+import numpy as np
+
+import body_parser
+from email_keys import email_key
+import fuzzy_names
+import header_parser
+import tracker_loader
+import instrumentation
+import pst_properties
+from extraction_cache import ExtractionCache
+from checkpoint import Checkpoint
+from diagnostics import Diagnostics
+import histogram
+from histogram import DAY_MS, WEEK_MS, Histogram
+from message_store import MATCH_EMAIL, MATCH_FUZZY_NAME, MATCH_NAME, UNMATCHED, MessageStore
+from result_store import ResultStore
+
+# libratom / pypff take a while to import and are only needed to read .pst files, see _open_archive()
+if TYPE_CHECKING:
+    from libratom.lib.pff import PffArchive
+    import pypff
+
+# Timings and counters of everything in here, see instrumentation.py
+# Worker processes have their own, which get merged back into this one
+stats = instrumentation.Stats()
 
 
 class Person:
     """
     Basic class to store a singular person, also contains basic matching algo
     """
+    __slots__ = ("_first_name", "_preferred_name", "_last_name", "_primary_email", "name", "preferred_name",
+                 "emails", "sanitized_emails", "_index")
 
     def __init__(self, first_name: str, preferred_name: str, last_name: str, emails: list[str]):
         self._first_name = first_name
         self._preferred_name = preferred_name
         self._last_name = last_name
+        # First email is the one from the tracker, used to tell apart people with the same name
+        self._primary_email = emails[0].strip() if emails else ""
 
         self.name = ((first_name or "") + " " + (last_name or "")).strip()
         self.preferred_name = ((preferred_name or "") + " " + (last_name or "")).strip()
 
-        # Set of emails / sanitized emails for matching
-        self.emails = {i.strip() for i in emails}
-        self.sanitized_emails = {i.lower().replace(".", "") for i in self.emails}
+        # Emails / sanitized emails (see email_keys.py) for matching, tuples like EmailMessage's since people only have
+        # a few. Unlike sets, tuples of strings aren't something the garbage collector has to keep going through
+        # Most people only have their tracker email, which skips dropping repeats
+        if len(emails) == 1:
+            self.emails = (self._primary_email,)
+            self.sanitized_emails = (email_key(self._primary_email),)
+        else:
+            self.emails = tuple(dict.fromkeys([i.strip() for i in emails]))
+            self.sanitized_emails = tuple(dict.fromkeys([email_key(i) for i in self.emails]))
+
+        # MatchIndex this person is registered in, so add_email can keep it up to date
+        self._index: 'MatchIndex | None' = None
 
     def __repr__(self):
         return f"{self.__class__.__name__}(name={self.name}, preferred_name={self.preferred_name}, emails={self.emails})"
@@ -38,8 +80,35 @@ class Person:
         """
         Since there's emails/sanitized emails, we call this method to add to both
         """
-        self.emails.add(email)
-        self.sanitized_emails.add(email.lower().replace(".", ""))
+        if email in self.emails:
+            return
+
+        sanitized = email_key(email)
+        self.emails += (email,)
+        if sanitized not in self.sanitized_emails:
+            self.sanitized_emails += (sanitized,)
+
+        if self._index is not None:
+            self._index.add_email(self, email, sanitized)
+
+    def add_preferred_name(self, preferred_name: str):
+        """
+        Someone can have a preferred name in one tracker and not in another, or a different one. Either way it's
+        matched on too, and it's the one shown if they didn't have one
+        """
+        if not (preferred_name or "").strip():
+            return
+
+        full_name = (preferred_name + " " + (self._last_name or "")).strip()
+        if full_name == self.preferred_name:
+            return
+
+        if not (self._preferred_name or "").strip():
+            self._preferred_name = preferred_name
+            self.preferred_name = full_name
+
+        if self._index is not None:
+            self._index.add_preferred_name(self, preferred_name, full_name)
 
     def is_same_person(self, other: 'Person') -> bool:
         """
@@ -55,7 +124,7 @@ class Person:
         Checks if the sanitized_emails of each person are disjoint from each other.
         If it's not disjoint, then we know that there's an email in common.
         """
-        return not self.sanitized_emails.isdisjoint(other.sanitized_emails)
+        return any(i in other.sanitized_emails for i in self.sanitized_emails)
 
     def does_name_match(self, other: 'Person') -> bool:
         """
@@ -79,29 +148,125 @@ class Person:
 
         return False
 
+    def _name_keys(self) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        """
+        Keys used to look this person up in a MatchIndex, mirrors does_name_match
+        Returns (keys to check against names, keys to check against preferred names)
+        """
+        return (self.name,), (self.preferred_name,)
+
+
+def _delivery_ms(message: 'pypff.message') -> int:
+    return int(message.get_delivery_time().timestamp() * 1000)
+
+
+class EmailRecord(NamedTuple):
+    """
+    Compact, picklable version of an EmailMessage so messages can be sent between processes
+    """
+    sender_name: str | None
+    sender_email: str | None
+    receive_time: int
+    subject: str | None = None
+    body: str | None = None
+
 
 class EmailMessage(Person):
     """
     Class used to represent an email message from an exported inbox
     """
-    def __init__(self, message: pypff.message):
+    __slots__ = ("receive_time", "subject", "source", "_message", "_email_contents")
+
+    def __init__(self, message: 'pypff.message'):
         # Since pypff.message doesn't give us the sender, we extract the email from the transport_headers
-        if match := re.search(r"From: (.+? )?<(.+?)>", message.transport_headers or ""):
-            sender_email = [match.group(2)]
-        elif match := re.search(r"From: ([^ ]+?@[^ ]+?\.[^ ]+?)", message.transport_headers or ""):
-            sender_email = [match.group(1)]
+        # The display name is only decoded if pypff doesn't have a sender name for us
+        if (sender_name := message.sender_name) is not None:
+            sender_email = header_parser.parse_sender_email(message.transport_headers)
         else:
-            sender_email = []
-        super().__init__(message.sender_name, message.sender_name, "", sender_email)
+            sender_name, sender_email = header_parser.parse_sender(message.transport_headers)
+        self._set_sender(sender_name, sender_email)
 
-        self.receive_time = int(message.get_delivery_time().timestamp() * 1000)
-        # Since pypff.message doesn't give us plain text body w/o replies, this is a hacky way of getting
-        # the email body. In the future, we can use ChatGPT / other LLM to automatically tag emails?
-        self.email_contents = EmailMessage.parse_html(message.html_body)
+        self.receive_time = _delivery_ms(message)
+        self.subject = message.subject
+        # Export the message came from, filled in by iter_emails()
+        self.source = None
+
+        # Body parsing is expensive and only needed if something reads email_contents, so we keep the
+        # message handle around and parse it lazily
+        self._message = message
+        self._email_contents = None
 
     def __repr__(self):
         return f"{self.__class__.__name__}(name={self.name}, preferred_name={self.preferred_name}, emails={self.emails}, receive_time={self.receive_time})"
 
+    def _set_sender(self, sender_name: str | None, sender_email: str | None):
+        """
+        Same as Person.__init__(sender_name, sender_name, "", [sender_email]), but a message only ever has one
+        email, so it gets a tuple with the shared key instead of two new sets
+        Messages can't have emails added to them
+        """
+        self._first_name = self._preferred_name = sender_name
+        self._last_name = ""
+        self.name = self.preferred_name = (sender_name or "").strip()
+
+        sender_email = sender_email.strip() if sender_email else ""
+        self._primary_email = sender_email
+        self.emails = (sender_email,) if sender_email else ()
+        self.sanitized_emails = (email_key(sender_email),) if sender_email else ()
+
+        self._index = None
+
+    @classmethod
+    def from_record(cls, record: EmailRecord) -> 'EmailMessage':
+        """
+        Rebuilds a message from an EmailRecord, the body is empty if the record was made without one
+        """
+        msg = cls.__new__(cls)
+        msg._set_sender(record.sender_name, record.sender_email)
+
+        msg.receive_time = record.receive_time
+        msg.subject = record.subject
+        msg.source = None
+        msg._message = None
+        msg._email_contents = record.body if record.body is not None else ""
+
+        return msg
+
+    @classmethod
+    def from_properties(cls, message: 'pypff.message', properties: dict[int, str] | None = None) -> 'EmailMessage':
+        """
+        Headers only version of EmailMessage(message), the sender comes from the message's MAPI properties so
+        the transport headers (and body) are never read. The headers are only parsed if the properties don't have
+        the sender's name / SMTP address (ie. Exchange senders)
+        Bodies can't be read from these, email_contents is always empty
+        """
+        if properties is None:
+            properties = pst_properties.read_properties(message)
+
+        sender_name = pst_properties.sender_name(properties)
+        sender_email = pst_properties.sender_email(properties)
+        if sender_name is None or sender_email is None:
+            stats.count("header_fallback")
+            header_name, header_email = header_parser.parse_sender(message.transport_headers)
+            sender_name = sender_name or header_name
+            sender_email = sender_email or header_email
+
+        msg = cls.__new__(cls)
+        msg._set_sender(sender_name, sender_email)
+
+        msg.receive_time = _delivery_ms(message)
+        # pypff's subject already has the prefix byte stripped, the raw property doesn't
+        msg.subject = message.subject
+        msg.source = None
+        msg._message = None
+        msg._email_contents = ""
+
+        return msg
+
+    def to_record(self, with_body: bool = False) -> EmailRecord:
+        return EmailRecord(self.name or None, next(iter(self.emails), None), self.receive_time, self.subject,
+                           self.email_contents if with_body else None)
+
     def does_name_match(self, other: 'Person') -> bool:
         # TODO - figure out if this is good or not
         if self.name == other.preferred_name:
@@ -109,48 +274,474 @@ class EmailMessage(Person):
 
         return Person.does_name_match(self, other)
 
+    def _name_keys(self) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        return (self.name,), (self.name, self.preferred_name)
+
+    @property
+    def email_contents(self) -> str:
+        """
+        Parsed body of the email, only parsed the first time it's requested
+        """
+        if self._email_contents is None:
+            # Since pypff.message doesn't give us plain text body w/o replies, this is a hacky way of getting
+            # the email body. In the future, we can use ChatGPT / other LLM to automatically tag emails?
+            with stats.time("html_parse"):
+                self._email_contents = EmailMessage.parse_html(self._message.html_body)
+            # Don't need the handle anymore once we have the contents
+            self._message = None
+
+        return self._email_contents
+
+    @email_contents.setter
+    def email_contents(self, contents: str):
+        self._email_contents = contents
+        self._message = None
+
+    def take_html(self) -> bytes | None:
+        """
+        Raw HTML body, for parsing it somewhere else (ie. a process pool) and handing it back through email_contents
+        The message handle is let go of after, pypff messages can't be sent to other processes
+        """
+        html = self._message.html_body if self._message is not None else None
+        self._message = None
+        return html
+
     @staticmethod
     def parse_html(html):
-        # Jank way of removing gmail quotes
-        parsed_html = BeautifulSoup((html or b"").decode("latin-1").strip().split("<hr")[0].split("---- Replied Message ----")[0], "html.parser")
+        # Quoted replies are dropped while parsing, see body_parser.py
+        return body_parser.parse_html(html)
+
+
+class MatchIndex:
+    """
+    Hash index over the people we match against so we don't scan every person per message
+    Maps sanitized email / name / preferred name to the set of people that have it
+    """
 
-        to_remove = [
-            ("div", {"class": "gmail_quote"}),
-            ("div", {"id": "mail-editor-reference-message-container"}),
-            ("blockquote", {"id": "isReplyContent"}),
-            ("blockquote", {"type": "cite"}),
-        ]
+    def __init__(self):
+        # A single person or a set of them, see _add() / get()
+        self.emails: dict[str, Person | set[Person]] = {}
+        # Emails as they were written, mappings are matched on these instead of the sanitized ones
+        self.raw_emails: dict[str, Person | set[Person]] = {}
+        self.names: dict[str, Person | set[Person]] = {}
+        self.preferred_names: dict[str, Person | set[Person]] = {}
 
-        for tag, atr in to_remove:
-            for elem in parsed_html.find_all(tag, atr):
-                elem.decompose()
+        # Only built the first time a fuzzy match is asked for, see find_fuzzy_name_matches
+        self.fuzzy_names: fuzzy_names.FuzzyNameIndex | None = None
 
-        return re.sub("\n\\s+", "\n", parsed_html.get_text()).strip()
+    def add_person(self, person: Person):
+        person._index = self
+
+        if self.fuzzy_names is not None:
+            self._add_fuzzy_name(person)
+
+        # Same as _add(), with the usual case of a key nobody else has done right here. Every person in a tracker
+        # goes through this, the extra calls were a good part of loading one
+        for index, keys in ((self.emails, person.sanitized_emails), (self.raw_emails, person.emails),
+                            (self.names, (person.name,)), (self.preferred_names, (person.preferred_name,))):
+            for key in keys:
+                if index.setdefault(key, person) is not person:
+                    self._add(index, key, person)
+
+    def add_email(self, person: Person, email: str, sanitized_email: str):
+        """
+        Called by Person.add_email so new emails (ie. from mappings) are matchable right away
+        """
+        self._add(self.emails, sanitized_email, person)
+        self._add(self.raw_emails, email, person)
+
+    def add_preferred_name(self, person: Person, preferred_name: str, full_name: str):
+        """
+        Called by Person.add_preferred_name, the preferred name they had is still matched on as well
+        """
+        self._add(self.preferred_names, full_name, person)
+        if self.fuzzy_names is not None:
+            self.fuzzy_names.add(person, (preferred_name,), person._last_name)
+
+    @staticmethod
+    def _add(index: dict[str, Person | set[Person]], key: str, person: Person):
+        # Most keys only have one person, so that person is stored as is and only turned into a set once a second
+        # one shows up. A set for every key kept the garbage collector busy loading big trackers
+        if (people := index.get(key)) is None:
+            index[key] = person
+        elif type(people) is set:
+            people.add(person)
+        elif people is not person:
+            index[key] = {people, person}
+
+    @staticmethod
+    def get(index: dict[str, Person | set[Person]], key: str) -> tuple[Person, ...] | set[Person]:
+        """
+        People with the key in one of the index's dicts
+        """
+        if (people := index.get(key)) is None:
+            return ()
+        return people if type(people) is set else (people,)
+
+    def _add_fuzzy_name(self, person: Person):
+        self.fuzzy_names.add(person, (person._first_name, person._preferred_name), person._last_name)
+
+    def find_email_matches(self, other: Person) -> set[Person]:
+        """
+        Same as checking does_email_match against every indexed person
+        """
+        matches = set()
+        for sanitized in other.sanitized_emails:
+            matches.update(self.get(self.emails, sanitized))
+
+        return matches
+
+    def find_name_matches(self, other: Person) -> set[Person]:
+        """
+        Same as checking does_name_match against every indexed person
+        """
+        name_keys, preferred_keys = other._name_keys()
 
+        matches = set()
+        for key in name_keys:
+            matches.update(self.get(self.names, key))
+        for key in preferred_keys:
+            matches.update(self.get(self.preferred_names, key))
 
-def extract_emails(email_export_file: str) -> list[EmailMessage]:
+        return matches
+
+    def find_fuzzy_name_matches(self, other: Person) -> set[Person]:
+        """
+        Closest people by name when the exact name didn't match, see fuzzy_names.py
+        """
+        if self.fuzzy_names is None:
+            self.fuzzy_names = fuzzy_names.FuzzyNameIndex()
+            for person in {i for key in self.names for i in self.get(self.names, key)}:
+                self._add_fuzzy_name(person)
+
+        return self.fuzzy_names.find(other.name)
+
+
+# Number of messages each worker decodes at a time when extracting with multiple processes
+WORKER_CHUNK_SIZE = 2000
+
+# How every worker process pool (here, batch.py and pipeline.py) starts its processes. Pools get made from
+# background threads (the GUI's run thread, the pipeline's decode thread), and forking a process that has threads
+# can leave the child stuck on a lock another thread held, so they're spawned like they are on Windows
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+# Archive opened by the current worker process, so we don't reopen it for every chunk
+_worker_archive: 'tuple[str, list[pypff.folder]] | None' = None
+
+
+# Called with (folders done, total folders) as extraction goes through a .pst file
+ProgressCallback = Callable[[int, int], None]
+
+
+def _open_archive(email_export_file: str) -> 'PffArchive':
+    from libratom.lib.pff import PffArchive
+
+    return PffArchive(email_export_file)
+
+
+class ExtractionOptions(NamedTuple):
     """
-    Function that extracts all emails from a .pst file
+    What gets read out of a .pst file, passed to the worker processes so it has to be picklable
+    """
+    # Only read the properties matching needs from each message (sender, time, subject), see pst_properties.py
+    # Bodies can't be read with this
+    headers_only: bool = False
+    # Folders to skip along with everything under them, fnmatch patterns (case insensitive) of a folder's name,
+    # ie. ("Deleted Items", "Junk*")
+    skip_folders: tuple[str, ...] = ()
+
+    def cache_key(self) -> str:
+        """
+        Options that change what gets cached, records made with other options aren't used
+        """
+        return f"headers_only={int(self.headers_only)};skip_folders={','.join(sorted(i.lower() for i in self.skip_folders))}"
+
+
+def _skip_folder(folder: 'pypff.folder', path: str, options: ExtractionOptions) -> bool:
+    # The root folder never has messages of its own
+    if folder.name is None:
+        return True
+
+    patterns = [i.lower() for i in options.skip_folders]
+    return any(fnmatch.fnmatchcase(name, pattern) for name in path.lower().split("/") if name for pattern in patterns)
+
+
+def _decode(message: 'pypff.message', options: ExtractionOptions) -> 'EmailMessage':
+    return EmailMessage.from_properties(message) if options.headers_only else EmailMessage(message)
+
+
+def count_emails(email_export_file: str, options: ExtractionOptions = ExtractionOptions()) -> int:
+    """
+    Number of messages iter_emails() goes through, this is cheap since pypff gets it from the folder index
+    """
+    with stats.time("pst_open"):
+        archive = _open_archive(os.path.abspath(email_export_file))
+        return sum(folder.number_of_sub_messages for folder, path in _walk_folders(archive) if not _skip_folder(folder, path, options))
+
+
+def _extract_record_chunk(email_export_file: str, folder_index: int, start: int, stop: int, with_body: bool,
+                          options: ExtractionOptions) -> tuple[list[EmailRecord], instrumentation.Stats]:
+    """
+    Runs in a worker process, decodes messages [start, stop) of a folder into EmailRecords
+    Also gives back the worker's stats for the chunk so they can be merged
+    """
+    global _worker_archive
+    stats.reset()
+
+    if _worker_archive is None or _worker_archive[0] != email_export_file:
+        with stats.time("pst_open"):
+            _worker_archive = (email_export_file, list(_open_archive(email_export_file).folders()))
+
+    folder = _worker_archive[1][folder_index]
+
+    decode_start = time.perf_counter()
+    messages = [_decode(folder.get_sub_message(i), options) for i in range(start, stop)]
+    decode = time.perf_counter() - decode_start
+
+    stats.add_time("decode", decode, len(messages))
+    stats.add_folder(folder.name, len(messages), decode)
+
+    return [m.to_record(with_body) for m in messages], stats
+
+
+def _iter_emails_parallel(email_export_file: str, workers: int, with_body: bool, progress: ProgressCallback | None,
+                          options: ExtractionOptions) -> Iterator[EmailMessage]:
+    """
+    Splits every folder into chunks of messages and decodes them across a process pool
+    Each worker opens its own archive, chunks are yielded back in the same order as a single process would
+    """
+    chunks = []
+    # Index of the folder each chunk finishes, so we can report progress
+    finishes_folder = []
+
+    with stats.time("pst_open"):
+        # Same order as PffArchive.folders(), which is what the workers index into
+        folders = [(i, f) for i, (f, path) in enumerate(_walk_folders(_open_archive(email_export_file))) if not _skip_folder(f, path, options)]
+    for folders_done, (folder_index, folder) in enumerate(folders, 1):
+        for start in range(0, folder.number_of_sub_messages, WORKER_CHUNK_SIZE):
+            chunks.append((folder_index, start, min(start + WORKER_CHUNK_SIZE, folder.number_of_sub_messages)))
+            finishes_folder.append(None)
+
+        if finishes_folder:
+            finishes_folder[-1] = folders_done
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT)
+    try:
+        results = pool.map(_extract_record_chunk, *zip(*((email_export_file, *c, with_body, options) for c in chunks)))
+
+        for (records, worker_stats), folders_done in zip(results, finishes_folder):
+            stats.merge(worker_stats)
+
+            for record in records:
+                yield EmailMessage.from_record(record)
+
+            if progress and folders_done:
+                progress(folders_done, len(folders))
+    finally:
+        # Don't wait for chunks nobody is going to read if we stopped early
+        pool.shutdown(cancel_futures=True)
+
+
+def _iter_emails_cached(cache: ExtractionCache, email_export_file: str, messages: Iterator[EmailMessage], cache_key: str) -> Iterator[EmailMessage]:
+    """
+    Passes messages through while writing their records to the cache
+    """
+    writer = cache.writer(email_export_file, cache_key)
+
+    for m in messages:
+        writer.add(m.name or None, next(iter(m.emails), None), m.receive_time, m.subject)
+        yield m
+
+    writer.finish()
+
+
+def iter_emails(email_export_file: str, workers: int = 1, with_body: bool = False, cache: ExtractionCache | None = None,
+                progress: ProgressCallback | None = None, options: ExtractionOptions = ExtractionOptions()) -> Iterator[EmailMessage]:
+    """
+    Generator that yields emails from a .pst file one at a time
+    Nothing is kept around, so memory doesn't grow with the size of the inbox
+
+    With workers > 1, messages are decoded in a process pool. Bodies have to be parsed in the workers then,
+    so with_body decides if email_contents is filled in or left empty
+
+    If a cache is given, the file is only decoded if it changed since it was cached. Bodies aren't cached,
+    so the cache is skipped with with_body
+
+    progress is called with (folders done, total folders) whenever a folder is decoded, it isn't called for cached files
+
+    options decides which folders are read and if only the headers are, see ExtractionOptions
+    """
+    if not os.path.exists(email_export_file):
+        print("Could not find file")
+        return
+    elif not email_export_file.endswith(".pst"):
+        print("Inputted file is not a .pst file")
+        return
+    elif with_body and options.headers_only:
+        print("Bodies can't be read when only reading headers")
+        return
+
+    source = os.path.basename(email_export_file)
+
+    if cache is not None and not with_body:
+        if (records := cache.load(email_export_file, options.cache_key())) is not None:
+            for record in records:
+                msg = EmailMessage.from_record(EmailRecord(*record))
+                msg.source = source
+                yield msg
+            return
+
+        messages = _iter_emails_cached(cache, email_export_file, _iter_pst(email_export_file, workers, with_body, progress, options),
+                                       options.cache_key())
+    else:
+        messages = _iter_pst(email_export_file, workers, with_body, progress, options)
+
+    try:
+        for msg in messages:
+            msg.source = source
+            yield msg
+    finally:
+        # Stops the process pool right away if we were closed early
+        messages.close()
+
+
+def _iter_pst(email_export_file: str, workers: int, with_body: bool, progress: ProgressCallback | None,
+             options: ExtractionOptions) -> Iterator[EmailMessage]:
+    if workers > 1:
+        yield from _iter_emails_parallel(os.path.abspath(email_export_file), workers, with_body, progress, options)
+        return
+
+    with stats.time("pst_open"):
+        archive = _open_archive(os.path.abspath(email_export_file))
+        folders = [folder for folder, path in _walk_folders(archive) if not _skip_folder(folder, path, options)]
+
+    for folders_done, folder in enumerate(folders, 1):
+        # Only the time spent decoding counts, not the time the consumer spends on each message
+        decode = 0.0
+
+        for i in range(folder.number_of_sub_messages):
+            start = time.perf_counter()
+            message = _decode(folder.get_sub_message(i), options)
+            decode += time.perf_counter() - start
+
+            yield message
+
+        stats.add_time("decode", decode, folder.number_of_sub_messages)
+        stats.add_folder(folder.name, folder.number_of_sub_messages, decode)
+
+        if progress:
+            progress(folders_done, len(folders))
+
+
+def _walk_folders(archive: 'PffArchive') -> Iterator[tuple['pypff.folder', str]]:
+    """
+    Same order as PffArchive.folders(), but also gives the path of each folder
+    Unlike identifiers, paths stay the same across exports of the same inbox
+    """
+    folders = deque([(next(archive.folders()), "")])
+
+    while folders:
+        folder, path = folders.pop()
+        yield folder, path
+
+        folders.extendleft((sub, f"{path}/{sub.name}") for sub in folder.sub_folders)
+
+
+def iter_new_emails(email_export_file: str, checkpoint: Checkpoint, export_key: str | None = None,
+                    options: ExtractionOptions = ExtractionOptions()) -> Iterator[EmailMessage]:
+    """
+    Like iter_emails(), but only yields messages that weren't processed by a previous run of the same export
+    Older messages are skipped by delivery time before anything else is read from them
+    export_key identifies the inbox across exports, it defaults to the file name without dates, see
+    Checkpoint.export_key()
     """
     if not os.path.exists(email_export_file):
         print("Could not find file")
-        return []
+        return
     elif not email_export_file.endswith(".pst"):
         print("Inputted file is not a .pst file")
-        return []
+        return
 
-    messages = []
-    archive = PffArchive(os.path.abspath(email_export_file))
+    export_key = export_key or Checkpoint.export_key(email_export_file)
+    with stats.time("pst_open"):
+        archive = _open_archive(os.path.abspath(email_export_file))
 
-    for folder in archive.folders():
-        # Add more to [None, ...] to ignore more folders
-        if folder.name in [None]:
+    for folder, path in _walk_folders(archive):
+        if _skip_folder(folder, path, options):
             continue
 
+        mark_time = checkpoint.mark_time(export_key, path)
+        decode = 0.0
+        decoded = 0
+
         for m in folder.sub_messages:
-            messages.append(EmailMessage(m))
+            start = time.perf_counter()
+            receive_time = _delivery_ms(m)
+            if receive_time < mark_time:
+                decode += time.perf_counter() - start
+                continue
+
+            if options.headers_only:
+                properties = pst_properties.read_properties(m)
+                message_id = pst_properties.message_id(properties)
+            else:
+                message_id = header_parser.parse_message_id(m.transport_headers)
+
+            if not checkpoint.is_new(export_key, path, receive_time, message_id):
+                decode += time.perf_counter() - start
+                continue
+
+            checkpoint.see(export_key, path, receive_time, message_id)
+            message = EmailMessage.from_properties(m, properties) if options.headers_only else EmailMessage(m)
+            message.source = export_key
+            decode += time.perf_counter() - start
+            decoded += 1
+
+            yield message
+
+        stats.add_time("decode", decode, decoded)
+        stats.add_folder(path or "/", decoded, decode)
 
-    return messages
+
+def extract_emails(email_export_file: str, workers: int = 1, with_body: bool = False, cache: ExtractionCache | None = None,
+                   options: ExtractionOptions = ExtractionOptions()) -> list[EmailMessage]:
+    """
+    Function that extracts all emails from a .pst file
+    Prefer iter_emails() + TrackerManager.compile_emails_stream() for large inboxes
+    """
+    return list(iter_emails(email_export_file, workers, with_body, cache, options=options))
+
+
+class MatchDecision(NamedTuple):
+    """
+    What matching decided for a sender, the same for every message with the same name / emails
+    """
+    # Counter in instrumentation.COUNTERS
+    result: str
+    # Who the messages go to, None if nobody (the dummy still gets unknown / ambiguous ones)
+    person: Person | None = None
+    match_kind: int = UNMATCHED
+    # Diagnostics category and the people it couldn't choose between
+    category: str | None = None
+    matches: list[Person] | set[Person] = ()
+
+
+class Rematched(NamedTuple):
+    """
+    Senders whose messages were matched again after a mapping / blacklist change, see TrackerManager._rematch()
+    """
+    # Matched or blacklisted now, they aren't unknown anymore
+    resolved: set[tuple[str, str]]
+    # Unknown or ambiguous now (ie. remapped to someone that already shares the email), they're unknown again
+    unresolved: set[tuple[str, str]]
+
+
+# What's printed for each diagnostics category, formatted with the message and the people it matched
+AMBIGUOUS_DETAILS = {
+    "ambiguous_email": "Message %s email got matched with multiple people: %s, skipping",
+    "ambiguous_name": "Message %s name got matched with multiple people: %s, skipping",
+    "ambiguous_fuzzy_name": "Message %s name is close to multiple people: %s, skipping",
+}
 
 
 class TrackerManager:
@@ -162,117 +753,306 @@ class TrackerManager:
     # Dummy person so we can count the number of emails received weekly
     DUMMY = Person("--- DUMMY ---", "--- DUMMY ---", "--- DUMMY ---", ["--- DUMMY ---"])
 
-    def __init__(self, add_dummy=False):
-        # List of people to match to, added from inputting into tracker
-        self.people: dict[Person, list[EmailMessage]] = {}
+    def __init__(self, add_dummy=False, fuzzy_match=False):
+        # People to match to, added from inputting into tracker, mapped to their index in self.messages
+        self.people: dict[Person, int] = {}
+
+        # Matched messages, stored as columns instead of keeping every EmailMessage
+        self.messages = MessageStore()
+        # Messages that aren't counted (blacklisted, or unmatched without the dummy), kept in case a mapping /
+        # blacklist loaded later changes that, see _rematch()
+        self.held = MessageStore(self.messages)
 
         # List of email mappings, added from email mapping file
         self.email_mappings = {}  # {recv_email: map_email}
+        # Reverse of email_mappings so we can follow mappings from a person's email
+        self._mapped_from: dict[str, set[str]] = {}  # {map_email: {recv_email, ...}}
 
         # Adds a dummy email if we want to count ALL emails, not just matched emails
         self.add_dummy = add_dummy
         if add_dummy:
-            self.people[TrackerManager.DUMMY] = []
+            self.people[TrackerManager.DUMMY] = 0
 
         # Blacklisting emails to add to dummy
         self.blacklist = set()
 
-    def load_email_blacklist(self, blacklist_file: str):
+        # Tries close names (middle names, accents, typos...) when the exact name doesn't match, off by default
+        # since it can match the wrong person
+        self.fuzzy_match = fuzzy_match
+
+        # Index of people for matching, the dummy isn't in here since no message should match it
+        self.match_index = MatchIndex()
+
+        # Decision for every sender seen, by (name, sanitized emails), so each sender is only matched once
+        # Anything that changes who matches (trackers, mappings, blacklist) clears it, see _clear_match_cache()
+        self._match_cache: dict[tuple[str, tuple[str, ...]], MatchDecision] = {}
+        self._match_cache_fuzzy = fuzzy_match
+        self.match_cache_hits = 0
+        self.match_cache_misses = 0
+
+        # Totals carried over from previous runs through a Checkpoint
+        self.carried_counts: dict[tuple[str, str, str, str], int] = {}
+        self.carried_days: dict[int, int] = {}
+
+        # Timings and counters, shared with the extraction functions
+        self.stats = stats
+
+        # Messages we had to skip, summarized at the end of every compile instead of printed one by one
+        self.diagnostics = Diagnostics()
+
+        # Tracker file each person came from
+        self.person_trackers: dict[Person, str] = {}
+        # People by tracker_loader.entry_key, so someone in more than one tracker is only added once
+        self._tracker_people: dict[tuple[str, str, str], Person] = {}
+
+        # Optional SQLite copy of the results, see attach_result_store()
+        self.result_store: ResultStore | None = None
+
+    def load_email_blacklist(self, blacklist_file: str) -> Rematched:
+        """
+        Adds the emails in the file to the blacklist, messages already matched from them are taken back
+        Gives back the senders whose messages were matched again, see _rematch()
+        """
         if not os.path.exists(blacklist_file):
             print("Could not find blacklist email file")
-            return
+            return Rematched(set(), set())
         elif not blacklist_file.endswith(".txt"):
             print("Inputted blacklist file is not a .txt file")
-            return
+            return Rematched(set(), set())
 
-        with open(blacklist_file, encoding="latin-1") as f:
+        new_keys = set()
+        with self.stats.time("file_load"), open(blacklist_file, encoding="latin-1") as f:
             for i in f:
-                self.blacklist.add(i.strip().lower().replace(".", ""))
+                if i.strip() and (key := email_key(i)) not in self.blacklist:
+                    self.blacklist.add(key)
+                    new_keys.add(key)
 
-    def load_tracker_csv(self, tracker_export_file: str):
-        if not os.path.exists(tracker_export_file):
-            print("Could not find tracker file")
-            return
-        elif not tracker_export_file.endswith(".csv"):
-            print("Inputted tacker file is not a .csv file")
-            return
+        self._clear_match_cache()
 
-        with open(tracker_export_file, encoding="latin-1") as f:
-            reader = csv.reader(f)
-            next(reader)  # Skipping column names
+        return self._rematch(new_keys)
 
-            for row in reader:
-                # Row isn't long enough
-                if not len(row) > 3:
-                    continue
-                # Blank Lines - Everyone should have a last name
-                if not row[2].strip():
-                    continue
+    def load_tracker_csv(self, tracker_export_file: str):
+        self.load_trackers([tracker_export_file])
 
-                emails = [row[3]]
+    def load_trackers(self, tracker_files: list[str]):
+        """
+        Loads tracker exports (.csv or .xlsx) in one go, see tracker_loader.py
+        Someone that's in more than one tracker (or was already loaded) is only added once, with all of their emails
+        """
+        for tracker_file in tracker_files:
+            if not os.path.exists(tracker_file):
+                print(f"Could not find tracker file {tracker_file}")
+                return
+            elif not tracker_file.lower().endswith(tracker_loader.TRACKER_EXTENSIONS):
+                print("Inputted tacker file is not a .csv or .xlsx file")
+                return
+
+        with self.stats.time("file_load"):
+            for tracker_file in tracker_files:
+                self._load_tracker_entries(tracker_loader.iter_tracker(tracker_file))
+
+    def _load_tracker_entries(self, entries: Iterable[tracker_loader.TrackerEntry]):
+        # Only the new emails need the mappings applied, there's nothing to apply before a mapping file is loaded
+        new_emails = [] if self._mapped_from else None
+
+        for entry in entries:
+            # Already loaded, only the emails / preferred name it didn't have are added
+            if (person := self._tracker_people.get(key := tracker_loader.entry_key(entry))) is not None:
+                person.add_preferred_name(entry.preferred_name)
+                for email in {i.strip() for i in entry.emails}.difference(person.emails):
+                    person.add_email(email)
+                    if new_emails is not None:
+                        new_emails.append((person, email))
+                continue
 
-                # Human inputted emails
-                if len(row) > 8:
-                    emails.extend(re.findall(r"[^\s@]+@[^\s@]+", row[8]))
+            person = Person(entry.first_name, entry.preferred_name, entry.last_name, entry.emails)
+            self.people[person] = len(self.people)
+            self.person_trackers[person] = entry.tracker
+            self._tracker_people[key] = person
+            self.match_index.add_person(person)
+            if new_emails is not None:
+                new_emails.extend((person, i) for i in person.emails)
 
-                self.people[Person(row[0], row[1], row[2], emails)] = []
+        for person, email in new_emails or ():
+            self._map_emails(person, [email])
 
-        self.update_email_mapping()
+        self._clear_match_cache()
 
-    def load_email_mapping(self, email_map_file):
+    def load_email_mapping(self, email_map_file) -> Rematched:
         if not os.path.exists(email_map_file):
             print("Could not find map file")
-            return
+            return Rematched(set(), set())
         elif not email_map_file.endswith(".json"):
             print("Inputted map file is not a .json file")
-            return
+            return Rematched(set(), set())
 
         # Need to figure out if we should use latin-1 or utf-16
-        with open(email_map_file, encoding="latin-1") as f:
-            self.email_mappings.update({i: j["map_email"] for i, j in json.load(f).items() if j["map_email"]})
+        with self.stats.time("file_load"):
+            with open(email_map_file, encoding="latin-1") as f:
+                mappings = {i: j["map_email"] for i, j in json.load(f).items() if j["map_email"]}
 
-        self.update_email_mapping()
+            return self.add_email_mappings(mappings)
 
-    def update_email_mapping(self):
+    def add_email_mappings(self, mappings: dict[str, str]) -> Rematched:
+        """
+        Adds {recv_email: map_email} mappings and applies only the new ones to the people they point to
+        Messages already compiled from the emails that got mapped are matched again, gives back their senders,
+        see _rematch()
+        """
+        new_mappings = []
+
+        for recv, data in mappings.items():
+            if self.email_mappings.get(recv) == data:
+                continue
+
+            # Remapping an email, emails already given out to people stay with them
+            if recv in self.email_mappings:
+                self._mapped_from[self.email_mappings[recv]].discard(recv)
+
+            self.email_mappings[recv] = data
+            self._mapped_from.setdefault(data, set()).add(recv)
+            new_mappings.append((recv, data))
+
+        added = []
+        for recv, data in new_mappings:
+            for p in list(self.match_index.get(self.match_index.raw_emails, data)):
+                added.extend(self._map_emails(p, [data]))
+
+        if new_mappings:
+            self._clear_match_cache()
+
+        return self._rematch({email_key(i) for i in added})
+
+    def update_email_mapping(self) -> Rematched:
         """
         Function to add the emails to each person
-        Called after we load email mappings / tracker data so everything is up to date
-        There probably is a better way of doing this though
+        Mappings are applied as they're loaded, so this is only needed if people's emails were changed by hand
+        """
+        added = []
+        for p in self.people:
+            added.extend(self._map_emails(p, list(p.emails)))
+
+        self._clear_match_cache()
+
+        return self._rematch({email_key(i) for i in added})
+
+    def _map_emails(self, person: Person, emails: list[str]) -> list[str]:
+        """
+        Adds every email that's mapped to one of emails to the person, gives back the ones that were added
+        Chains of mappings (recv -> mapped -> mapped) are followed, so the order they were loaded in doesn't matter
         """
-        for recv, data in self.email_mappings.items():
-            for p in self.people:
-                if data in p.emails:
-                    p.add_email(recv)
+        added = []
+        while emails:
+            for recv in self._mapped_from.get(emails.pop(), ()):
+                if recv not in person.emails:
+                    person.add_email(recv)
+                    emails.append(recv)
+                    added.append(recv)
+
+        return added
 
     def reset_manager(self):
         """
         Resets the manager so we can run a new set of data
         """
-        self.people: dict[Person, list[EmailMessage]] = {}
+        self.people: dict[Person, int] = {}
+        self.messages = MessageStore()
+        self.held = MessageStore(self.messages)
         self.email_mappings = {}  # {recv_email: map_email}
+        self._mapped_from = {}
 
         # Adds a dummy email if we want to count ALL emails, not just matched emails
         if self.add_dummy:
-            self.people[TrackerManager.DUMMY] = []
+            self.people[TrackerManager.DUMMY] = 0
 
         self.blacklist = set()
+        self.match_index = MatchIndex()
+        self._clear_match_cache()
+        self.match_cache_hits = 0
+        self.match_cache_misses = 0
+        self.carried_counts = {}
+        self.carried_days = {}
+        self.stats.reset()
+        self.diagnostics.reset()
+        self.person_trackers = {}
+        self._tracker_people = {}
+
+        if self.result_store is not None:
+            self.result_store.clear()
+
+    def attach_result_store(self, result_store: ResultStore):
+        """
+        Keeps a copy of the results in SQLite, anything already in the store is replaced
+        extract_total_emails / extract_weekly_emails are worked out with SQL from then on
+        """
+        self.result_store = result_store
+        self.result_store.clear()
+
+    def sync_result_store(self):
+        """
+        Writes anything new to the attached result store, the reports do this on their own
+        """
+        self.result_store.sync(
+            ((i, *TrackerManager._person_key(p), self.person_trackers.get(p)) for p, i in self.people.items()),
+            self.messages
+        )
+
+    def checkpoint_fingerprint(self) -> str:
+        """
+        Hash of everything that decides who an email counts for (people, mappings, blacklist and matching options),
+        kept in checkpoints so totals counted with different ones aren't added to, see Checkpoint.matches()
+        """
+        inputs = (
+            sorted(TrackerManager._person_key(p) for p in self.people),
+            sorted(self.email_mappings.items()),
+            sorted(self.blacklist),
+            self.add_dummy,
+            self.fuzzy_match,
+        )
+        return hashlib.sha256(json.dumps(inputs).encode("utf-8")).hexdigest()[:16]
+
+    def load_checkpoint(self, checkpoint: Checkpoint):
+        """
+        Carries over the totals from previous runs, so they're included in extract_total/weekly_emails
+        """
+        self.carried_counts = dict(checkpoint.person_counts)
+        self.carried_days = dict(checkpoint.day_counts)
+
+    def update_checkpoint(self, checkpoint: Checkpoint):
+        """
+        Adds the messages matched in this run to the checkpoint's totals and commits its new marks
+        Only call this once per run, otherwise the messages get counted twice
+        """
+        with self.stats.time("aggregation"):
+            counts = self.messages.counts(len(self.people))
+            person_counts = {TrackerManager._person_key(p): int(counts[i]) for p, i in self.people.items() if counts[i]}
+
+            days, day_counts = np.unique(self.messages.times_array() // DAY_MS, return_counts=True)
+
+        checkpoint.add_totals(person_counts, dict(zip(days.tolist(), day_counts.tolist())))
+        checkpoint.fingerprint = self.checkpoint_fingerprint()
+        checkpoint.commit()
+
+    @staticmethod
+    def _person_key(person: Person) -> tuple[str, str, str, str]:
+        """
+        Key for a person that stays the same across runs, names alone aren't unique in the tracker
+        """
+        return person._first_name, person._preferred_name, person._last_name, person._primary_email
 
     def _find_matching_person(self, msg: EmailMessage) -> tuple[list[Person], list[Person]]:
         """
         Finds the matching person in our people list given an email message
         Splits it into email_matches and name_matches since name_matches gives higher false positives
         """
-        email_matches = []
-        name_matches = []
-
-        for p in self.people:
-            if msg.does_email_match(p):
-                email_matches.append(p)
-
-            if msg.does_name_match(p):
-                name_matches.append(p)
+        return list(self.match_index.find_email_matches(msg)), list(self.match_index.find_name_matches(msg))
 
-        return email_matches, name_matches
+    def _clear_match_cache(self):
+        """
+        Forgets every sender's decision, called whenever the people, mappings or blacklist change
+        """
+        self._match_cache = {}
+        self._match_cache_fuzzy = self.fuzzy_match
 
     def _email_in_blacklist(self, person: Person) -> bool:
         """
@@ -284,43 +1064,203 @@ class TrackerManager:
         """
         Matches all the emails from extract_emails() to a particular person
         """
-        unknown_emails = []
+        return self.compile_emails_stream(email_export)
 
-        for e in email_export:
-            # Skipping if they're in the blacklist
-            if self._email_in_blacklist(e):
-                continue
-            elif not e.emails:
-                print(f"Could not find email for `{e.name}`, skipping")
-                continue
+    def compile_emails_stream(self, email_export: Iterable[EmailMessage]) -> set[tuple[str, str]]:
+        """
+        Matches emails to a particular person as they come in (ie. from iter_emails())
+        Unknown emails are only kept as (name, email) so they can be dropped right away
+        """
+        unknown_emails = set()
+
+        with self.matching_run(unknown_emails) as match_email:
+            for e in email_export:
+                match_email(e)
+
+        return unknown_emails
+
+    @contextlib.contextmanager
+    def matching_run(self, unknown_emails: set[tuple[str, str]]) -> Iterator[Callable[[EmailMessage], str]]:
+        """
+        Gives a function that matches one email, with the same timing, counters and diagnostics summary as
+        compile_emails_stream(), for code that gets its emails some other way (ie. pipeline.py)
+        Unknown emails are added to unknown_emails
+        """
+        # Only the time spent matching counts, the emails might be decoding as we go
+        counts = dict.fromkeys(instrumentation.COUNTERS, 0)
+        matching = 0.0
+
+        # fuzzy_match is set straight on the manager (ie. by the GUI), so the cache can't know it changed until now
+        if self.fuzzy_match != self._match_cache_fuzzy:
+            self._clear_match_cache()
+        hits, misses = self.match_cache_hits, self.match_cache_misses
+
+        def match_email(e: EmailMessage) -> str:
+            nonlocal matching
+            start = time.perf_counter()
+            result = self._compile_email(e, unknown_emails)
+            counts[result] += 1
+            matching += time.perf_counter() - start
+            return result
+
+        try:
+            yield match_email
+        finally:
+            self.stats.add_time("matching", matching, sum(counts.values()))
+            for counter, amount in counts.items():
+                self.stats.count(counter, amount)
+            self.stats.count("match_cache_hits", self.match_cache_hits - hits)
+            self.stats.count("match_cache_misses", self.match_cache_misses - misses)
+
+            self.diagnostics.print_summary()
+            self.diagnostics.reset()
+
+    def _compile_email(self, e: EmailMessage, unknown_emails: set[tuple[str, str]]) -> str:
+        """
+        Matches a single email, gives back which counter in instrumentation.COUNTERS it falls under
+        Senders are only matched the first time they're seen, see _match_sender()
+        """
+        decision = self._decide(e)
+
+        if decision.person is not None:
+            self._add_message(decision.person, e, decision.match_kind)
+            return decision.result
+
+        # Skipping if they're in the blacklist
+        if decision.result == "blacklisted":
+            self._add_message(None, e, UNMATCHED)
+            return decision.result
+        elif decision.result == "missing_email":
+            self.diagnostics.report("missing_email", e.name, "Could not find email for `%s`, skipping", e.name)
+            return decision.result
+
+        if decision.category is not None:
+            self.diagnostics.report(decision.category, f"{e.name} <{next(iter(e.emails))}>",
+                                    AMBIGUOUS_DETAILS[decision.category], e, decision.matches)
+
+        unknown_emails.add((e.name, next(iter(e.emails))))
+
+        # Adds dummy for weekly email count
+        self._add_message(TrackerManager.DUMMY if self.add_dummy else None, e, UNMATCHED)
 
-            email_matches, name_matches = self._find_matching_person(e)
-            unknown = True
+        return decision.result
 
-            # email_matches first since this is lowest false positive
-            if email_matches:
-                # If it only matches 1 person, then we're fine!
-                if len(email_matches) == 1:
-                    self.people[email_matches[0]].append(e)
-                    unknown = False
+    def _decide(self, e: EmailMessage) -> MatchDecision:
+        key = (e.name, e.sanitized_emails)
+        if (decision := self._match_cache.get(key)) is None:
+            decision = self._match_cache[key] = self._match_sender(e)
+            self.match_cache_misses += 1
+        else:
+            self.match_cache_hits += 1
+
+        return decision
+
+    def _match_sender(self, e: EmailMessage) -> MatchDecision:
+        """
+        Decides who a message goes to, only depends on the sender's name and emails
+        """
+        # Skipping if they're in the blacklist
+        if self._email_in_blacklist(e):
+            return MatchDecision("blacklisted")
+        elif not e.emails:
+            return MatchDecision("missing_email")
+
+        email_matches, name_matches = self._find_matching_person(e)
+
+        # email_matches first since this is lowest false positive
+        if email_matches:
+            # If it only matches 1 person, then we're fine!
+            if len(email_matches) == 1:
+                return MatchDecision("matched_by_email", email_matches[0], MATCH_EMAIL)
+
+            return MatchDecision("ambiguous", category="ambiguous_email", matches=email_matches)
+        elif name_matches:
+            # If it only matches 1 person, then we're fine!
+            if len(name_matches) == 1:
+                return MatchDecision("matched_by_name", name_matches[0], MATCH_NAME)
+
+            return MatchDecision("ambiguous", category="ambiguous_name", matches=name_matches)
+        elif self.fuzzy_match and (fuzzy_matches := self.match_index.find_fuzzy_name_matches(e)):
+            # Only tried last, it's the most likely to be wrong
+            if len(fuzzy_matches) == 1:
+                return MatchDecision("matched_by_fuzzy_name", next(iter(fuzzy_matches)), MATCH_FUZZY_NAME)
+
+            return MatchDecision("ambiguous", category="ambiguous_fuzzy_name", matches=fuzzy_matches)
+
+        return MatchDecision("unknown")
+
+    def _add_message(self, person: Person | None, msg: EmailMessage, match_kind: int):
+        """
+        Stores the message for the person, only the columns we need are kept so msg can be dropped after
+        Without a person, it's held back instead (see _rematch), unless it has no email since nothing can change that
+        """
+        if person is None and not msg.emails:
+            return
+
+        sender_id = self.messages.intern_sender(msg.name, next(iter(msg.emails), None))
+        source_id = self.messages.intern_source(msg.source)
+
+        if person is None:
+            self.held.add(0, msg.receive_time, sender_id, match_kind, source_id)
+        else:
+            self.messages.add(self.people[person], msg.receive_time, sender_id, match_kind, source_id)
+
+    def _rematch(self, changed_keys: set[str]) -> Rematched:
+        """
+        Matches the messages of the senders with one of changed_keys (see email_keys.py) again, after new mappings /
+        blacklist entries changed who they go to. Their messages are moved between people, the dummy and the held
+        back messages in place, nothing else is touched
+        Gives back the senders that are matched / blacklisted now, so they can be taken out of the unknown emails,
+        and the ones that aren't, so they can be added back (a remap can make a matched sender ambiguous)
+        """
+        affected = [i for i, (name, email) in enumerate(self.messages.senders) if email and email_key(email) in changed_keys]
+        if not affected:
+            return Rematched(set(), set())
+
+        resolved, unresolved = set(), set()
+
+        with self.stats.time("rematch"):
+            counted_rows = self.messages.rows_by_sender(affected)
+            held_rows = self.held.rows_by_sender(affected)
+            # Rows are only dropped after everything is copied, so row numbers stay the same until then
+            drop_counted, drop_held = [], []
+
+            for sender_id in affected:
+                name, email = self.messages.senders[sender_id]
+                decision = self._decide(EmailMessage.from_record(EmailRecord(name, email, 0)))
+
+                if decision.person is not None:
+                    person, match_kind = decision.person, decision.match_kind
+                elif decision.result != "blacklisted" and self.add_dummy:
+                    person, match_kind = TrackerManager.DUMMY, UNMATCHED
                 else:
-                    print(f"Message {e} email got matched with multiple people: {email_matches}, skipping")
-            elif name_matches:
-                # If it only matches 1 person, then we're fine!
-                if len(name_matches) == 1:
-                    self.people[name_matches[0]].append(e)
-                    unknown = False
+                    person, match_kind = None, UNMATCHED
+
+                if decision.person is not None or decision.result == "blacklisted":
+                    resolved.add((name, email))
+                else:
+                    unresolved.add((name, email))
+
+                if person is None:
+                    self.held.copy_rows(self.messages, counted_rows[sender_id], 0, match_kind)
+                    drop_counted.append(counted_rows[sender_id])
                 else:
-                    print(f"Message {e} name got matched with multiple people: {name_matches}, skipping")
+                    self.messages.set_person(counted_rows[sender_id], self.people[person], match_kind)
+                    self.messages.copy_rows(self.held, held_rows[sender_id], self.people[person], match_kind)
+                    drop_held.append(held_rows[sender_id])
 
-            if unknown:
-                unknown_emails.append(e)
+                self.stats.count("rematched", len(counted_rows[sender_id]) + len(held_rows[sender_id]))
 
-                # Adds dummy for weekly email count
-                if self.add_dummy:
-                    self.people[TrackerManager.DUMMY].append(e)
+            if drop_counted:
+                self.messages.drop_rows(np.concatenate(drop_counted))
+            if drop_held:
+                self.held.drop_rows(np.concatenate(drop_held))
 
-        return {(e.name, e.emails.pop() if e.emails else None) for e in unknown_emails}
+            # The stored messages changed in place, so they're written again
+            if self.result_store is not None:
+                self.result_store.reset_messages()
+
+        return Rematched(resolved, unresolved)
 
     @staticmethod
     def generate_mapping(unknown: set[tuple[str, str]]) -> dict[str, dict]:
@@ -329,39 +1269,64 @@ class TrackerManager:
         """
         return {i[1]: {"name": i[0], "map_email": ""} for i in unknown if i[1]}
 
-    def extract_weekly_emails(self, start_time: datetime.date, num_weeks: int) -> list[int]:
+    def extract_histogram(self, start_time: datetime.date, num_bins: int, bin_ms: int = WEEK_MS, align_to_monday: bool = False, per_person: bool = False) -> Histogram:
         """
-        Extracts the emails per week
-        Every week is at least 7 days, so if first day isn't on a Monday then we group the first week with the next week
+        Counts the emails in bins of bin_ms (ie. histogram.DAY_MS / WEEK_MS) from start_time
+        With per_person, counts are a (people x bins) matrix in the same order as self.people
+
+        Totals carried over from a checkpoint only have a day, so they're counted at the start of their day,
+        and they aren't included per person
+        If there's a result store attached, the matched messages are counted in SQL instead
         """
-        start_dt = int(datetime.datetime.combine(start_time, datetime.time(), tzinfo=datetime.timezone.utc).timestamp() * 1000)
-        if start_time.weekday() != 0:
-            start_dt += (7 - start_time.weekday()) * 86400000
+        with self.stats.time("aggregation"):
+            start = histogram.start_ms(start_time, align_to_monday)
+
+            if self.result_store is not None:
+                self.sync_result_store()
+
+                if per_person:
+                    return self.result_store.bucket_by_person(start, bin_ms, num_bins, len(self.people))
+                matched = self.result_store.bucket(start, bin_ms, num_bins)
+            else:
+                times = self.messages.times_array()
 
-        email_counts = [0 for _ in range(num_weeks)]
+                if per_person:
+                    return histogram.bucket_by_person(times, self.messages.people_array(), len(self.people), start, bin_ms, num_bins)
+                matched = histogram.bucket(times, start, bin_ms, num_bins)
 
-        for emails in self.people.values():
-            for e in emails:
-                weeks_after = (e.receive_time - start_dt) // 604800000
-                if weeks_after >= num_weeks:
-                    # Don't count this email since it's weird
-                    print(f"Email did not found within bounds: {weeks_after}")
-                    continue
+            carried_times = np.fromiter(self.carried_days.keys(), dtype=np.int64, count=len(self.carried_days)) * DAY_MS
+            carried_counts = np.fromiter(self.carried_days.values(), dtype=np.int64, count=len(self.carried_days))
+            carried = histogram.bucket(carried_times, start, bin_ms, num_bins, carried_counts)
 
-                if weeks_after < 0:
-                    # Just saying everything before the 'start time' is just first week
-                    weeks_after = 0
+            return Histogram(matched.counts + carried.counts, matched.before + carried.before, matched.after + carried.after)
+
+    def extract_weekly_emails(self, start_time: datetime.date, num_weeks: int) -> list[int]:
+        """
+        Extracts the emails per week
+        Every week is at least 7 days, so if first day isn't on a Monday then we group the first week with the next week
+        """
+        result = self.extract_histogram(start_time, num_weeks, WEEK_MS, align_to_monday=True)
 
-                email_counts[weeks_after] += 1
+        if result.after:
+            # Don't count these emails since they're weird
+            print(f"{result.after} emails were not within bounds, skipping")
 
-        return email_counts
+        return result.counts.tolist()
 
     def extract_total_emails(self) -> list[tuple[str, str, str, int]]:
         """
         Extracts the emails per person
         Returns in a csv-like format of: (first name, preferred name, last name, number of emails)
         """
-        return sorted(((i._first_name, i._preferred_name, i._last_name, len(self.people[i])) for i in self.people if i != TrackerManager.DUMMY), key=lambda x: x[2].lower())
+        with self.stats.time("aggregation"):
+            if self.result_store is not None:
+                self.sync_result_store()
+                totals = self.result_store.totals()
+                counts = [totals.get(i, 0) for i in range(len(self.people))]
+            else:
+                counts = self.messages.counts(len(self.people))
+
+            return sorted(((i._first_name, i._preferred_name, i._last_name, int(counts[j]) + self.carried_counts.get(TrackerManager._person_key(i), 0)) for i, j in self.people.items() if i != TrackerManager.DUMMY), key=lambda x: x[2].lower())
 
 
 def export_mapping(unknown, mapping_file=None):
@@ -0,0 +1,91 @@
+from typing import TextIO
+
+# Every category has a line in the summary even if it's empty
+CATEGORIES = ("missing_email", "ambiguous_email", "ambiguous_name")
+
+
+class Diagnostics:
+    """
+    Collects the "skipping" events from a run instead of printing every single one
+    Events are counted by category and by sender, the first few of each category are still printed right away
+    Memory stays bounded, only max_senders senders are tracked per category and the rest are counted together
+
+    If detail_file is given, every event is also written there as a line of `category<TAB>sender<TAB>detail`
+    It's overwritten the first time something is written to it, later runs add to it
+    """
+
+    def __init__(self, print_limit: int = 5, max_senders: int = 1000, top_senders: int = 10, detail_file: str | None = None):
+        self.print_limit = print_limit
+        self.max_senders = max_senders
+        self.top_senders = top_senders
+
+        self.detail_file = detail_file
+        self._detail: TextIO | None = None
+        self._detail_started = False
+
+        self.counts: dict[str, int] = {}
+        self.senders: dict[str, dict[str, int]] = {}
+        # Events from senders that didn't fit in max_senders
+        self.other_senders: dict[str, int] = {}
+
+    def report(self, category: str, sender: str, detail: str = "", *args, amount: int = 1):
+        """
+        Records an event, detail is formatted with args (like logging) only if it's printed or written out
+        """
+        count = self.counts.get(category, 0)
+        self.counts[category] = count + amount
+
+        senders = self.senders.setdefault(category, {})
+        if sender in senders or len(senders) < self.max_senders:
+            senders[sender] = senders.get(sender, 0) + amount
+        else:
+            self.other_senders[category] = self.other_senders.get(category, 0) + amount
+
+        if count < self.print_limit or self.detail_file:
+            text = detail % args if args else detail
+
+            if count < self.print_limit:
+                print(text)
+                if count + 1 == self.print_limit:
+                    print(f"Further `{category}` messages are only in the summary")
+
+            if self.detail_file:
+                if self._detail is None:
+                    self._detail = open(self.detail_file, "a" if self._detail_started else "w", encoding="utf-8")
+                    self._detail_started = True
+                self._detail.write(f"{category}\t{sender}\t{text}\n")
+
+    def summary(self) -> str:
+        lines = []
+
+        for category in (*CATEGORIES, *sorted(set(self.counts) - set(CATEGORIES))):
+            count = self.counts.get(category, 0)
+            lines.append(f"{category.replace('_', ' ')}: {count:,}")
+
+            top = sorted(self.senders.get(category, {}).items(), key=lambda x: -x[1])[:self.top_senders]
+            lines.extend(f"    {sender}: {amount:,}" for sender, amount in top)
+
+            if other := self.other_senders.get(category):
+                lines.append(f"    (other senders): {other:,}")
+
+        return "\n".join(lines)
+
+    def print_summary(self):
+        # Nothing went wrong, nothing to say
+        if self.counts:
+            print(self.summary())
+
+        if self._detail is not None:
+            self._detail.flush()
+
+    def reset(self):
+        self.counts = {}
+        self.senders = {}
+        self.other_senders = {}
+
+        self.close()
+
+    def close(self):
+        if self._detail is not None:
+            self._detail.close()
+            self._detail = None
@@ -0,0 +1,48 @@
+import sys
+from collections import OrderedDict
+
+# Domains that are the same inbox as another domain, ie. students' @mail.utoronto.ca mail also goes to @utoronto.ca
+DOMAIN_ALIASES = {
+    "mail.utoronto.ca": "utoronto.ca",
+}
+
+# Keys already worked out, by the email as it was given, most recently used last. The least recently used one is
+# dropped once there's MAX_KEYS of them so it can't grow forever
+_keys: OrderedDict[str, str] = OrderedDict()
+MAX_KEYS = 65536
+
+
+def email_key(email: str) -> str:
+    """
+    Key two emails are matched on, every spelling of the same inbox gives the same key:
+    lowercase, no dots or +tag in the part before the @, and the domain aliases in DOMAIN_ALIASES followed
+    ie. "John.Doe+tracker@Mail.UToronto.ca" -> "johndoe@utoronto.ca"
+
+    Cached in an LRU and interned since the same few hundred senders show up over and over, so people and
+    messages with the same email share a single key string
+    An OrderedDict instead of functools.lru_cache, its links aren't objects the garbage collector has to go through
+    """
+    if (key := _keys.get(email)) is not None:
+        _keys.move_to_end(email)
+        return key
+
+    key = _keys[email] = _email_key(email)
+    if len(_keys) > MAX_KEYS:
+        _keys.popitem(last=False)
+
+    return key
+
+
+def _email_key(email: str) -> str:
+    email = email.strip().lower()
+
+    local, at, domain = email.rpartition("@")
+    if not at:
+        # Not an email (ie. the dummy), only the dots are dropped like before
+        return sys.intern(email.replace(".", ""))
+
+    # Don't drop the whole thing if it starts with a +
+    local = (local.split("+", 1)[0] or local).replace(".", "")
+    domain = DOMAIN_ALIASES.get(domain, domain)
+
+    return sys.intern(f"{local}@{domain}")
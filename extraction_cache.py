@@ -0,0 +1,156 @@
+import hashlib
+import os
+import sqlite3
+from typing import Iterator
+
+# How much of the start / end of the file goes into the fingerprint hash
+FINGERPRINT_BYTES = 1 << 20
+
+# Bump this whenever the tables change so old caches get rebuilt
+SCHEMA_VERSION = 3
+
+
+def fingerprint(file: str) -> tuple[str, int, int, str]:
+    """
+    Cheap fingerprint of a file: (absolute path, size, mtime, hash of the first and last MiB)
+    Exports are way too big to hash fully, but this is enough to tell a re-export apart
+    """
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+
+    return path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite cache of the records extracted from .pst files, so re-running after editing the mappings or
+    blacklist doesn't need to decode the whole export again
+    Records are (sender name, sender email, receive time, subject) tuples, bodies aren't cached
+    Each file is cached along with the extraction options it was read with (options), so changing them
+    (ie. skipping more folders) reads the file again
+    """
+
+    def __init__(self, cache_file: str):
+        self.cache_file = cache_file
+        # Batch runs write to the same cache from several processes, so wait on locks instead of failing
+        self.connection = sqlite3.connect(cache_file, timeout=60, check_same_thread=False)
+
+        # Several processes can open the same cache at once, so the schema is checked / made in one transaction
+        self.connection.execute("BEGIN IMMEDIATE")
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS records")
+            self.connection.execute("DROP TABLE IF EXISTS files")
+            self.connection.execute("""
+                CREATE TABLE files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    options TEXT NOT NULL DEFAULT '',
+                    complete INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE records (
+                    file_id INTEGER NOT NULL REFERENCES files(id),
+                    sender_name TEXT,
+                    sender_email TEXT,
+                    receive_time INTEGER NOT NULL,
+                    subject TEXT
+                )
+            """)
+            self.connection.execute("CREATE INDEX records_file ON records(file_id)")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def _find_file(self, file: str, options: str) -> int | None:
+        path, size, mtime_ns, digest = fingerprint(file)
+        row = self.connection.execute(
+            "SELECT id FROM files WHERE path = ? AND size = ? AND mtime_ns = ? AND digest = ? AND options = ? AND complete = 1",
+            (path, size, mtime_ns, digest, options)
+        ).fetchone()
+
+        return row[0] if row else None
+
+    def load(self, file: str, options: str = "") -> Iterator[tuple[str | None, str | None, int, str | None]] | None:
+        """
+        Returns the cached records for the file, or None if the file isn't cached with these options / has changed since
+        """
+        file_id = self._find_file(file, options)
+        if file_id is None:
+            return None
+
+        return self._iter_records(file_id)
+
+    def _iter_records(self, file_id: int) -> Iterator[tuple[str | None, str | None, int, str | None]]:
+        # Every batch is its own query, so no read is left open in between: a batch worker can wait a long time on a
+        # full queue halfway through a file, and an open read would keep the other workers from writing to the cache
+        last = 0
+        while rows := self.connection.execute(
+            "SELECT rowid, sender_name, sender_email, receive_time, subject FROM records WHERE file_id = ? AND rowid > ? "
+            "ORDER BY rowid LIMIT 5000", (file_id, last)
+        ).fetchall():
+            last = rows[-1][0]
+            for row in rows:
+                yield row[1:]
+
+    def writer(self, file: str, options: str = "") -> 'CacheWriter':
+        """
+        Starts (re-)caching a file, any old records for the same path are dropped
+        """
+        path, size, mtime_ns, digest = fingerprint(file)
+
+        with self.connection:
+            self.connection.execute("DELETE FROM records WHERE file_id IN (SELECT id FROM files WHERE path = ?)", (path,))
+            self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            file_id = self.connection.execute(
+                "INSERT INTO files (path, size, mtime_ns, digest, options) VALUES (?, ?, ?, ?, ?)", (path, size, mtime_ns, digest, options)
+            ).lastrowid
+
+        return CacheWriter(self.connection, file_id)
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM records")
+            self.connection.execute("DELETE FROM files")
+
+
+class CacheWriter:
+    """
+    Writes records for a single file in batches
+    The file is only marked as cached once finish() is called, so a cancelled run is never used
+    """
+    BATCH_SIZE = 5000
+
+    def __init__(self, connection: sqlite3.Connection, file_id: int):
+        self.connection = connection
+        self.file_id = file_id
+        self.batch = []
+
+    def add(self, sender_name: str | None, sender_email: str | None, receive_time: int, subject: str | None):
+        self.batch.append((self.file_id, sender_name, sender_email, receive_time, subject))
+        if len(self.batch) >= CacheWriter.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO records (file_id, sender_name, sender_email, receive_time, subject) VALUES (?, ?, ?, ?, ?)", self.batch
+            )
+        self.batch = []
+
+    def finish(self):
+        self._flush()
+        with self.connection:
+            self.connection.execute("UPDATE files SET complete = 1 WHERE id = ?", (self.file_id,))
@@ -0,0 +1,153 @@
+import functools
+import re
+import unicodedata
+from typing import Hashable, Iterable
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# Most edits allowed between a whole name and a tracker name
+MAX_DISTANCE = 2
+
+
+@functools.lru_cache(maxsize=65536)
+def name_tokens(name: str | None) -> tuple[str, ...]:
+    """
+    Lowercase words of a name without accents or punctuation, ie. "Zoë O'Brien-Li" -> ("zoe", "obrien", "li")
+    Apostrophes are dropped, any other punctuation splits words
+    Cached since the same senders show up over and over
+    """
+    name = name or ""
+    if not name.isascii():
+        name = unicodedata.normalize("NFKD", name)
+        name = "".join(i for i in name if not unicodedata.combining(i)).replace("’", "")
+
+    name = name.lower().replace("'", "")
+
+    return tuple(i for i in _NON_WORD.split(name) if i)
+
+
+def _max_edits(token: str) -> int:
+    # Short names are too easy to turn into other names, they have to match exactly
+    if len(token) <= 3:
+        return 0
+    return 1 if len(token) <= 6 else 2
+
+
+def bounded_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein distance between a and b, anything over limit comes back as limit + 1
+    Stops as soon as every path is over the limit, so very different names are cheap to rule out
+    """
+    if a == b:
+        return 0
+    elif abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+
+    return min(previous[-1], limit + 1)
+
+
+def _match_cost(required: tuple[str, ...], tokens: tuple[str, ...], limit: int) -> int:
+    """
+    Edits needed so every required word is one of tokens (each token used once), extra tokens like middle names
+    are free and the order doesn't matter. Over limit comes back as limit + 1
+    """
+    remaining = list(tokens)
+    leftover = []
+
+    # Exact words first so a fuzzy match can't take a word that something else matches exactly
+    for word in required:
+        if word in remaining:
+            remaining.remove(word)
+        else:
+            leftover.append(word)
+
+    cost = 0
+    for word in leftover:
+        word_limit = min(_max_edits(word), limit - cost)
+
+        best, best_index = word_limit + 1, None
+        for index, token in enumerate(remaining):
+            distance = bounded_distance(word, token, word_limit)
+            if distance < best:
+                best, best_index = distance, index
+
+        if best_index is None:
+            return limit + 1
+
+        cost += best
+        del remaining[best_index]
+
+    return cost
+
+
+class FuzzyNameIndex:
+    """
+    Finds people whose name is close to a sender's name, for senders the exact name match missed because of
+    middle names, accents, a "Last, First" order or a typo in the first name
+
+    People are put in blocks by (last name word, first initial), a sender is only compared against the blocks its
+    own words could make, so only a handful of people get scored per sender
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+
+        # {(last name word, first initial): {(key, words that have to match), ...}}
+        self.blocks: dict[tuple[str, str], set[tuple[Hashable, tuple[str, ...]]]] = {}
+
+    def add(self, key: Hashable, first_names: Iterable[str | None], last_name: str | None):
+        """
+        Adds someone under key (ie. a Person), first_names are every first name they go by (ie. legal / preferred)
+        """
+        last = name_tokens(last_name)
+        if not last:
+            return
+
+        for first_name in first_names:
+            # Only the first word of a first name has to match, the rest are usually middle names
+            if not (first := name_tokens(first_name)):
+                continue
+
+            required = (first[0], *last)
+            for word in last:
+                self.blocks.setdefault((word, first[0][0]), set()).add((key, required))
+
+    def candidates(self, tokens: tuple[str, ...]) -> set[tuple[Hashable, tuple[str, ...]]]:
+        """
+        Everyone in a block that the sender's words make, any word could be the last name
+        """
+        found = set()
+        for i, last in enumerate(tokens):
+            for j, first in enumerate(tokens):
+                if i != j:
+                    found.update(self.blocks.get((last, first[0]), ()))
+
+        return found
+
+    def find(self, name: str | None) -> set:
+        """
+        Keys of the closest people to name, more than one if they're tied, empty if nobody is close enough
+        """
+        tokens = name_tokens(name)
+        if len(tokens) < 2:
+            return set()
+
+        best, matches = self.max_distance + 1, set()
+        for key, required in self.candidates(tokens):
+            cost = _match_cost(required, tokens, min(best, self.max_distance))
+            if cost < best:
+                best, matches = cost, {key}
+            elif cost == best and cost <= self.max_distance:
+                matches.add(key)
+
+        return matches
@@ -1,26 +1,38 @@
+import asyncio
+import contextlib
 import csv
 import io
 import json
 import os
+import queue
 import sys
+import threading
+import batch
+import cli
 import data_parser
+import instrumentation
+import pipeline
 import tkinter as tk
-from tkinter.filedialog import askopenfilename, asksaveasfilename
+from tkinter.filedialog import askdirectory, askopenfilename, askopenfilenames, asksaveasfilename
 from datetime import date
 
 
-class MainFrameIO(io.StringIO):
+class MainFrameIO(io.TextIOBase):
     """
     Basic class to hijack Python Print
+    Nothing is kept, everything is passed straight through, so long runs don't grow memory
     """
 
     def __init__(self, mainframe: 'MainFrame'):
         super().__init__()
         self.parent = mainframe
 
+    def writable(self):
+        return True
+
     def write(self, __s):
-        io.StringIO.write(self, __s)
         self.parent.stdout(__s)
+        return len(__s)
 
 
 class MainFrame(tk.Frame):
@@ -36,17 +48,29 @@ class MainFrame(tk.Frame):
         # Locks certain functionality of the gui, not strictly needed, but it helps to stop random bugs
         self.lock_input = False
         self.lock_extract = False
+        # After a run only the trackers stay locked, new mappings / blacklists just re-match the senders they change
+        self.lock_trackers = False
 
         # Set of unknown emails to be used for when we export email mapping
         self.unknown_emails = set()
 
+        # Background thread for Run, it posts progress events to the queue which we poll with after()
+        self.worker: threading.Thread | None = None
+        self.worker_events: queue.Queue = queue.Queue()
+        self.cancel_event = threading.Event()
+
+        # Cache of extracted .pst files so re-running the same export doesn't decode it again
+        self.extraction_cache = data_parser.ExtractionCache(os.path.join(os.path.dirname(__file__), "extraction_cache.sqlite3"))
+        # Folders to skip / headers only, from the same config as cli.py
+        self.extraction_options = cli.extraction_options(cli.load_config())
+
         # Hijacking print console
         self.orig_stdout = sys.stdout
         sys.stdout = MainFrameIO(self)
 
         tk.Label(text="Tracker File: ").grid(row=0, column=0, sticky="e")
         self.tracker_btn = tk.Button(parent, text="Pick File", command=self.load_tracker_cb)
-        self.tracker_file = None
+        self.tracker_files: list[str] = []
         self.tracker_btn.grid(row=0, column=1, sticky="w")
 
         # tk.Label(text="Tracker Entries: ", font=(font.nametofont('TkTextFont').actual(), 7)).grid(row=1, column=0, sticky="e")
@@ -76,12 +100,24 @@ class MainFrame(tk.Frame):
 
         self.load_files_btn = tk.Button(text="Load Files", width=20, command=self.load_files)
         self.load_files_btn.grid(row=6, column=1)
-        tk.Button(text="Reset Data", width=20, command=self.reset_data_cb).grid(row=6, column=2)
+        self.reset_btn = tk.Button(text="Reset Data", width=20, command=self.reset_data_cb)
+        self.reset_btn.grid(row=6, column=2)
 
         # self.info_label = tk.Label(text="Loaded Tracker Entries: 0 | Loaded Mapping Entries: 0 | Loaded Blacklist Entries: 0")
         # self.info_label.grid(row=7, column=0, columnspan=4)
 
         tk.Label(text="").grid(row=9, column=0)
+
+        # Weeks for Extract Weekly, defaults come from the same config as cli.py
+        report_config = cli.load_config()["report"]
+        tk.Label(text="First Week / Weeks: ").grid(row=13, column=0, sticky="e")
+        self.start_date = tk.Entry(width=12)
+        self.start_date.insert(0, str(report_config["start_date"]))
+        self.start_date.grid(row=13, column=1, sticky="w")
+        self.num_weeks = tk.Entry(width=5)
+        self.num_weeks.insert(0, str(report_config["weeks"]))
+        self.num_weeks.grid(row=13, column=2, sticky="w")
+
         tk.Label(text="").grid(row=14, column=0)
 
         tk.Label(text="Email File: ").grid(row=15, column=0, sticky="e")
@@ -89,22 +125,46 @@ class MainFrame(tk.Frame):
         self.email_file = None
         self.email_btn.grid(row=15, column=1, sticky="w")
 
-        tk.Button(text="Run", width=20, command=self.run_cb).grid(row=16, column=1)
+        # Alternatively a whole folder of exports can be run at once
+        self.email_folder_btn = tk.Button(parent, text="Pick Folder", command=self.load_email_folder_cb)
+        self.email_folder = None
+        self.email_folder_btn.grid(row=15, column=2, sticky="w")
+
+        # Off by default, close names can be the wrong person
+        self.fuzzy_match = tk.BooleanVar(value=False)
+        tk.Checkbutton(text="Fuzzy Name Matching", variable=self.fuzzy_match).grid(row=16, column=0)
+
+        self.run_btn = tk.Button(text="Run", width=20, command=self.run_cb)
+        self.run_btn.grid(row=16, column=1)
         self.ext_map_btn = tk.Button(text="Extract Mappings", width=20, command=self.ext_map_cb, state="disabled")
         self.ext_map_btn.grid(row=16, column=2)
         self.ext_tot_btn = tk.Button(text="Extract Total", width=20, command=self.ext_tot_cb, state="disabled")
         self.ext_tot_btn.grid(row=17, column=1)
         self.ext_week_btn = tk.Button(text="Extract Weekly", width=20, command=self.ext_week_cb, state="disabled")
         self.ext_week_btn.grid(row=17, column=2)
+        self.cancel_btn = tk.Button(text="Cancel", width=20, command=self.cancel_cb, state="disabled")
+        self.cancel_btn.grid(row=18, column=1)
+        self.stats_btn = tk.Button(text="Show Stats", width=20, command=self.stats_cb)
+        self.stats_btn.grid(row=18, column=2)
+
+        # Window showing where the time went, only created once someone asks for it
+        self.stats_window: tk.Toplevel | None = None
+        self.stats_text: tk.Text | None = None
+
+        self.progress_label = tk.Label(text="")
+        self.progress_label.grid(row=19, column=0, columnspan=3)
 
     def load_tracker_cb(self):
-        if self.lock_input:
+        if self.lock_input or self.lock_trackers:
             return
 
-        self.tracker_file = askopenfilename(filetypes=[("CSV Files", "*.csv")], initialdir=os.path.dirname(__file__), title="Pick tracker file")
+        # More than one tracker can be picked, they're merged when loaded
+        self.tracker_files = list(askopenfilenames(filetypes=[("Tracker Files", "*.csv *.xlsx"), ("CSV Files", "*.csv"), ("Excel Files", "*.xlsx")], initialdir=os.path.dirname(__file__), title="Pick tracker files"))
 
-        if self.tracker_file:
-            self.tracker_btn.config(text=os.path.basename(self.tracker_file))
+        if len(self.tracker_files) == 1:
+            self.tracker_btn.config(text=os.path.basename(self.tracker_files[0]))
+        elif self.tracker_files:
+            self.tracker_btn.config(text=f"{len(self.tracker_files)} files")
         else:
             self.tracker_btn.config(text="Pick File")
 
@@ -113,9 +173,21 @@ class MainFrame(tk.Frame):
 
         if self.email_file:
             self.email_btn.config(text=os.path.basename(self.email_file))
+            self.email_folder = None
+            self.email_folder_btn.config(text="Pick Folder")
         else:
             self.email_btn.config(text="Pick File")
 
+    def load_email_folder_cb(self):
+        self.email_folder = askdirectory(initialdir=os.path.dirname(__file__), title="Pick folder of email export files")
+
+        if self.email_folder:
+            self.email_folder_btn.config(text=os.path.basename(self.email_folder))
+            self.email_file = None
+            self.email_btn.config(text="Pick File")
+        else:
+            self.email_folder_btn.config(text="Pick Folder")
+
     def load_email_mapping_cb(self):
         if self.lock_input:
             return
@@ -139,25 +211,32 @@ class MainFrame(tk.Frame):
             self.blacklist_btn.config(text="Pick File")
 
     def reset_file_pickers(self):
-        self.tracker_file = None
+        self.tracker_files = []
         self.email_file = None
+        self.email_folder = None
         self.email_mapping_file = None
         self.blacklist_file = None
 
         self.tracker_btn.config(text="Pick File")
         self.email_btn.config(text="Pick File")
+        self.email_folder_btn.config(text="Pick Folder")
         self.email_mapping_btn.config(text="Pick File")
         self.blacklist_btn.config(text="Pick File")
 
     def load_files(self):
+        if self.worker is not None:
+            return
+
+        # Emails that already ran and are matched / blacklisted now don't need to be exported as unknown anymore,
+        # and ones a new mapping made ambiguous need to be again
         if self.blacklist_file:
-            self.manager.load_email_blacklist(self.blacklist_file)
+            self.update_unknown_emails(self.manager.load_email_blacklist(self.blacklist_file))
 
         if self.email_mapping_file:
-            self.manager.load_email_mapping(self.email_mapping_file)
+            self.update_unknown_emails(self.manager.load_email_mapping(self.email_mapping_file))
 
-        if self.tracker_file:
-            self.manager.load_tracker_csv(self.tracker_file)
+        if self.tracker_files:
+            self.manager.load_trackers(self.tracker_files)
 
         self.reset_file_pickers()
         # self.info_label.config(
@@ -167,20 +246,28 @@ class MainFrame(tk.Frame):
         self.email_mapping_count.config(text=str(len(self.manager.email_mappings)))
         self.blacklist_count.config(text=str(len(self.manager.blacklist)))
 
+    def update_unknown_emails(self, rematched: data_parser.Rematched):
+        self.unknown_emails -= rematched.resolved
+        self.unknown_emails |= rematched.unresolved
+
     def reset_data_cb(self):
+        if self.worker is not None:
+            return
+
         self.manager.reset_manager()
         self.reset_file_pickers()
 
+        self.lock_trackers = False
         self.unlock_input_buttons()
         self.lock_extract_buttons()
 
         self.unknown_emails = set()
 
     def lock_input_buttons(self):
-        self.lock_input = False
+        self.lock_input = True
 
         self.tracker_btn.config(text="Disabled", state="disabled")
-        self.tracker_file = None
+        self.tracker_files = []
 
         self.email_mapping_btn.config(text="Disabled", state="disabled")
         self.email_mapping_file = None
@@ -193,8 +280,9 @@ class MainFrame(tk.Frame):
     def unlock_input_buttons(self):
         self.lock_input = False
 
-        self.tracker_btn.config(text="Pick File", state="normal")
-        self.tracker_file = None
+        if not self.lock_trackers:
+            self.tracker_btn.config(text="Pick File", state="normal")
+        self.tracker_files = []
 
         self.email_mapping_btn.config(text="Pick File", state="normal")
         self.email_mapping_file = None
@@ -219,18 +307,153 @@ class MainFrame(tk.Frame):
         self.ext_week_btn.config(state="normal")
 
     def run_cb(self):
-        if not self.email_file:
+        if not (self.email_file or self.email_folder) or self.worker is not None:
+            return
+
+        email_files = [self.email_file] if self.email_file else batch.find_exports(self.email_folder)
+        if not email_files:
+            print("Could not find any .pst files")
             return
 
         self.lock_input_buttons()
+        self.lock_extract_buttons()
+        self.run_btn.config(state="disabled")
+        self.reset_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+        self.progress_label.config(text="Starting...")
+
+        # Read once here, the worker thread can't touch tk
+        self.manager.fuzzy_match = self.fuzzy_match.get()
 
-        data = data_parser.extract_emails(self.email_file)
-        self.unknown_emails.update(self.manager.compile_emails(data))
+        self.cancel_event.clear()
+        self.worker = threading.Thread(target=self.run_worker, args=(email_files,), daemon=True)
+        self.worker.start()
 
         self.email_file = None
+        self.email_folder = None
         self.email_btn.config(text="Pick File")
+        self.email_folder_btn.config(text="Pick Folder")
+
+        self.after(100, self.poll_worker)
+
+    def cancel_cb(self):
+        if self.worker is not None:
+            self.cancel_event.set()
+            self.progress_label.config(text="Cancelling...")
+
+    def run_worker(self, email_files: list[str]):
+        """
+        Runs on the worker thread, nothing in here can touch tk, everything goes through self.worker_events
+        """
+        # So we can roll back everything this run added if it gets cancelled
+        start_length = len(self.manager.messages)
+        start_held = len(self.manager.held)
+
+        try:
+            unknown = asyncio.run(self.run_pipeline(email_files))
+        except Exception as e:
+            self.manager.messages.truncate(start_length)
+            self.manager.held.truncate(start_held)
+            self.worker_events.put(("error", e))
+            return
 
-        self.unlock_extract_buttons()
+        if self.cancel_event.is_set():
+            self.manager.messages.truncate(start_length)
+            self.manager.held.truncate(start_held)
+            self.worker_events.put(("cancelled",))
+        else:
+            self.worker_events.put(("done", unknown))
+
+    async def run_pipeline(self, email_files: list[str]) -> set[tuple[str, str]] | None:
+        """
+        Matches the exports with pipeline.py, passing its progress on to the tk thread, None if cancelled
+        One process per export when there's more than one, duplicates across inboxes are only counted once
+        """
+        events = pipeline.run(self.manager, email_files, cache=self.extraction_cache, options=self.extraction_options,
+                              cancel=self.cancel_event)
+
+        async with contextlib.aclosing(events):
+            async for event in events:
+                if self.cancel_event.is_set():
+                    return None
+
+                if isinstance(event, pipeline.Progress):
+                    self.worker_events.put(("progress", *event))
+                else:
+                    return event.unknown_emails
+
+    def poll_worker(self):
+        """
+        Runs on the tk thread, takes events from the worker and updates the gui
+        """
+        while True:
+            try:
+                event = self.worker_events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event[0] == "progress":
+                _, done, total, folders_done, folders_total, rate, total_exact = event
+                eta = int(max(total - done, 0) / rate) if rate else 0
+                folders = f"Folders {folders_done}/{folders_total} | " if folders_total else ""
+                # Duplicates across inboxes aren't all known yet, so it might finish sooner
+                up_to = "" if total_exact else "up to "
+                self.progress_label.config(text=f"{folders}{done:,}/{up_to}{total:,} messages | {rate:,.0f} msg/s | ETA {up_to}{eta // 60}:{eta % 60:02}")
+                continue
+
+            if event[0] == "done":
+                self.unknown_emails.update(event[1])
+                self.progress_label.config(text="Done")
+                self.manager.stats.emit(instrumentation.print_sink, *([self.stats_panel_sink] if self.stats_window else []))
+                # The people can't change anymore once messages are matched to them, but mappings / blacklists can
+                # still be loaded. A cancelled or failed run kept nothing, so trackers stay as they were
+                self.lock_trackers = True
+            elif event[0] == "cancelled":
+                self.progress_label.config(text="Cancelled, nothing from this run was kept")
+            else:
+                self.progress_label.config(text="Failed, nothing from this run was kept")
+                print(f"Run failed: {event[1]!r}")
+
+            self.worker = None
+            self.run_btn.config(state="normal")
+            self.reset_btn.config(state="normal")
+            self.cancel_btn.config(state="disabled")
+            self.unlock_extract_buttons()
+            self.unlock_input_buttons()
+            return
+
+        self.after(100, self.poll_worker)
+
+    def stats_cb(self):
+        # Stats are still being written to while running
+        if self.worker is not None:
+            return
+
+        self.manager.stats.emit(self.stats_panel_sink)
+
+    def stats_panel_sink(self, report: dict):
+        """
+        instrumentation sink that shows the report in its own window
+        """
+        if self.stats_window is None:
+            self.stats_window = tk.Toplevel(self)
+            self.stats_window.title("Stats")
+            self.stats_window.protocol("WM_DELETE_WINDOW", self.close_stats_window)
+
+            self.stats_text = tk.Text(self.stats_window, width=60, height=20)
+            self.stats_text.pack(fill="both", expand=True)
+
+        folders = "\n".join(f"{i}: {j['messages']:,} messages in {j['seconds']:.3f}s" for i, j in report["folders"].items())
+
+        self.stats_text.config(state="normal")
+        self.stats_text.delete("1.0", "end")
+        self.stats_text.insert("end", instrumentation.format_report(report).replace(", ", "\n") + "\n\n" + folders)
+        self.stats_text.config(state="disabled")
+
+    def close_stats_window(self):
+        self.stats_window.destroy()
+        self.stats_window = None
+        self.stats_text = None
 
     def ext_map_cb(self):
         if self.lock_extract:
@@ -269,6 +492,13 @@ class MainFrame(tk.Frame):
         if self.lock_extract:
             return
 
+        try:
+            start_date = date.fromisoformat(self.start_date.get().strip())
+            num_weeks = int(self.num_weeks.get())
+        except ValueError:
+            print("First week should look like 2024-05-22 and weeks should be a number")
+            return
+
         file = asksaveasfilename(filetypes=[("Txt Files", "*.txt")], initialdir=os.path.dirname(__file__), title="Pick Weekly Extract File")
         if not file:
             print("Save file not found")
@@ -277,8 +507,7 @@ class MainFrame(tk.Frame):
         if not file.endswith(".txt"):
             file += ".txt"
 
-        # TODO - Make this configurable
-        weekly_emails = self.manager.extract_weekly_emails(start_time=date(year=2024, month=5, day=22), num_weeks=12)
+        weekly_emails = self.manager.extract_weekly_emails(start_time=start_date, num_weeks=num_weeks)
         with open(file, "w") as f:
             f.write("\n".join(map(str, weekly_emails)))
 
@@ -289,7 +518,7 @@ class MainFrame(tk.Frame):
 def main():
     root = tk.Tk()
     root.title("AR Email Tracker")
-    root.geometry("500x300")
+    root.geometry("500x385")
     root.resizable(False, False)
 
     MainFrame(root).tkraise()
@@ -0,0 +1,118 @@
+import re
+from email.header import decode_header, make_header
+
+# Continuation lines of a folded header (RFC 5322), unfolded into a single space
+_FOLDING = re.compile(r"\r?\n[ \t]+")
+# End of a field, the first line break that isn't followed by whitespace
+_FIELD_END = re.compile(r"\n(?![ \t])")
+# Case-insensitive start of a field by name, only used when the usual spelling isn't there, see _field_start()
+_FIELD_STARTS: dict[str, re.Pattern] = {}
+
+
+def _field_start(field: str) -> re.Pattern:
+    if (pattern := _FIELD_STARTS.get(field)) is None:
+        pattern = _FIELD_STARTS[field] = re.compile(r"\n" + re.escape(field) + ":", re.IGNORECASE)
+
+    return pattern
+
+
+def find_field(transport_headers: str | None, field: str) -> str | None:
+    """
+    Finds the value of the first `field` in the headers, unfolded into one line
+    Stops scanning as soon as the field is found, so long Received/DKIM blocks after it are never read
+    """
+    if not transport_headers:
+        return None
+
+    prefix = field + ":"
+    if transport_headers.startswith(prefix):
+        start = len(prefix)
+    elif (index := transport_headers.find("\n" + prefix)) != -1:
+        start = index + len(prefix) + 1
+    # Header names are case-insensitive, a plain find is a lot faster though so that's tried first
+    elif transport_headers[:len(prefix)].lower() == prefix.lower():
+        start = len(prefix)
+    elif match := _field_start(field).search(transport_headers):
+        start = match.end()
+    else:
+        return None
+
+    end = match.start() if (match := _FIELD_END.search(transport_headers, start)) else len(transport_headers)
+
+    value = transport_headers[start:end]
+    if "\n" in value:
+        value = _FOLDING.sub(" ", value)
+
+    return value.strip()
+
+
+def find_from_field(transport_headers: str | None) -> str | None:
+    return find_field(transport_headers, "From")
+
+
+def parse_message_id(transport_headers: str | None) -> str | None:
+    """
+    Gets the Message-ID of the email, this stays the same across exports unlike pypff's identifier
+    """
+    return find_field(transport_headers, "Message-ID")
+
+
+def decode_display_name(name: str) -> str:
+    """
+    Decodes RFC 2047 encoded-words (=?utf-8?q?...?=) and strips the quoting around a display name
+    """
+    name = name.strip().strip('"')
+    if "\\" in name:
+        name = name.replace('\\"', '"')
+
+    if "=?" in name:
+        try:
+            name = str(make_header(decode_header(name)))
+        except (ValueError, LookupError):
+            # Malformed / unknown charset, just keep it as is
+            pass
+
+    return name
+
+
+def _split_sender(value: str) -> tuple[str, str | None]:
+    """
+    Splits an unfolded From: value into (raw display name, email)
+    """
+    # `Name <addr>`, the address is always the last <...> in the field, usually right at the end
+    if value.endswith(">") and (start := value.rfind("<")) != -1 and "@" in value[start:]:
+        return value[:start], value[start + 1:-1].strip()
+    elif (start := value.rfind("<")) != -1 and (end := value.find(">", start)) != -1 and "@" in value[start:end]:
+        return value[:start], value[start + 1:end].strip()
+    elif "@" in value:
+        # Bare address, it's the word with the @ in it. Anything else is the name, either old style `addr (Name)`
+        # or `Name addr` from clients that left out the brackets
+        at = value.find("@")
+        start = value.rfind(" ", 0, at) + 1
+        if (end := value.find(" ", at)) == -1:
+            end = len(value)
+
+        return (value[:start] + value[end:]).strip().strip("()"), value[start:end].strip("<>\",;:")
+
+    return value, None
+
+
+def parse_sender_email(transport_headers: str | None) -> str | None:
+    """
+    Same as parse_sender()[1], but doesn't bother decoding the display name
+    """
+    value = find_field(transport_headers, "From")
+    return _split_sender(value)[1] if value else None
+
+
+def parse_sender(transport_headers: str | None) -> tuple[str | None, str | None]:
+    """
+    Gets (display name, email) of the sender from the transport headers
+    Either can be None if it couldn't be found
+    """
+    value = find_field(transport_headers, "From")
+    if not value:
+        return None, None
+
+    name, email = _split_sender(value)
+    return decode_display_name(name) or None, email
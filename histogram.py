@@ -0,0 +1,73 @@
+import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+HOUR_MS = 3600000
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+
+
+class Histogram(NamedTuple):
+    """
+    Result of bucketing receive times
+    counts is 1-D (bins) or 2-D (people x bins) depending on how it was made
+    Anything before the start is counted in the first bin, anything after the last bin is dropped
+    """
+    counts: np.ndarray
+    before: int
+    after: int
+
+
+def start_ms(start_time: datetime.date, align_to_monday: bool = False) -> int:
+    """
+    Midnight UTC of start_time in ms
+    With align_to_monday, a start that isn't on a Monday gets pushed to the next Monday, so the first week
+    is grouped with the days before it
+    """
+    start = int(datetime.datetime.combine(start_time, datetime.time(), tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    if align_to_monday and start_time.weekday() != 0:
+        start += (7 - start_time.weekday()) * DAY_MS
+
+    return start
+
+
+def _bins(times: np.ndarray, start: int, bin_ms: int, num_bins: int, weights: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray, int, int]:
+    """
+    Gives back (bin of every time, mask of times that are counted, before, after)
+    """
+    bins = (np.asarray(times, dtype=np.int64) - start) // bin_ms
+    out_of_range = bins >= num_bins
+
+    if weights is None:
+        before = int(np.count_nonzero(bins < 0))
+        after = int(np.count_nonzero(out_of_range))
+    else:
+        before = int(weights[bins < 0].sum())
+        after = int(weights[out_of_range].sum())
+
+    np.maximum(bins, 0, out=bins)
+    return bins, ~out_of_range, before, after
+
+
+def bucket(times: np.ndarray, start: int, bin_ms: int, num_bins: int, weights: np.ndarray | None = None) -> Histogram:
+    """
+    Counts how many times fall in each bin of bin_ms, starting at start (both in ms)
+    weights can be used when a time stands for more than one message
+    """
+    bins, in_range, before, after = _bins(times, start, bin_ms, num_bins, weights)
+
+    counts = np.bincount(bins[in_range], None if weights is None else weights[in_range], minlength=num_bins)
+    return Histogram(counts.astype(np.int64), before, after)
+
+
+def bucket_by_person(times: np.ndarray, people: np.ndarray, num_people: int, start: int, bin_ms: int, num_bins: int) -> Histogram:
+    """
+    Same as bucket(), but counts are split up per person into a (num_people, num_bins) matrix
+    people is the index of the person each time belongs to
+    """
+    bins, in_range, before, after = _bins(times, start, bin_ms, num_bins)
+
+    flat = np.asarray(people, dtype=np.int64)[in_range] * num_bins + bins[in_range]
+    counts = np.bincount(flat, minlength=num_people * num_bins).reshape(num_people, num_bins)
+    return Histogram(counts.astype(np.int64), before, after)
@@ -0,0 +1,105 @@
+import contextlib
+import json
+import time
+from typing import Callable, Iterator
+
+# Order stages are shown in, anything else is shown after these
+STAGES = ("file_load", "pst_open", "decode", "html_parse", "matching", "aggregation")
+COUNTERS = ("matched_by_email", "matched_by_name", "matched_by_fuzzy_name", "ambiguous", "blacklisted", "missing_email", "unknown")
+
+
+class Stats:
+    """
+    Timers and counters for where time goes during a run
+    Everything is plain dicts so it can be pickled back from worker processes and merged
+    """
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+        self.counters: dict[str, int] = {}
+        # {folder name: [messages, seconds]}, folders with the same name in different exports are added together
+        self.folders: dict[str, list] = {}
+
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.folders = {}
+
+    @contextlib.contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1):
+        self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    def count(self, counter: str, amount: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def add_folder(self, folder: str, messages: int, seconds: float):
+        totals = self.folders.setdefault(folder, [0, 0])
+        totals[0] += messages
+        totals[1] += seconds
+
+    def merge(self, other: 'Stats'):
+        """
+        Adds another Stats (ie. from a worker process) into this one
+        """
+        for stage, seconds in other.seconds.items():
+            self.add_time(stage, seconds, other.calls.get(stage, 0))
+        for counter, amount in other.counters.items():
+            self.count(counter, amount)
+        for folder, (messages, seconds) in other.folders.items():
+            self.add_folder(folder, messages, seconds)
+
+    def snapshot(self) -> dict:
+        order = {j: i for i, j in enumerate(STAGES)}
+
+        return {
+            "stages": {
+                i: {"seconds": round(self.seconds[i], 6), "calls": self.calls.get(i, 0)}
+                for i in sorted(self.seconds, key=lambda x: (order.get(x, len(order)), x))
+            },
+            "counters": {i: self.counters.get(i, 0) for i in (*COUNTERS, *sorted(set(self.counters) - set(COUNTERS)))},
+            "folders": {i: {"messages": j[0], "seconds": round(j[1], 6)} for i, j in self.folders.items()},
+        }
+
+    def emit(self, *sinks: 'Sink'):
+        report = self.snapshot()
+        for sink in sinks:
+            sink(report)
+
+
+# Gets a snapshot() of the stats, ie. print_sink, json_file_sink(...) or the stats panel in the gui
+Sink = Callable[[dict], None]
+
+
+def format_report(report: dict) -> str:
+    """
+    Human readable version of a snapshot(), one line per stage and a line for the counters
+    """
+    lines = [f"{stage}: {data['seconds']:.3f}s ({data['calls']:,} calls)" for stage, data in report["stages"].items()]
+    lines.append(", ".join(f"{i.replace('_', ' ')}: {j:,}" for i, j in report["counters"].items()))
+
+    return "\n".join(lines)
+
+
+def print_sink(report: dict):
+    print(format_report(report))
+
+
+def json_file_sink(file: str) -> Sink:
+    """
+    Sink that writes the snapshot to a json file, overwriting it every time
+    """
+    def sink(report: dict):
+        with open(file, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return sink
@@ -0,0 +1,126 @@
+from array import array
+
+import numpy as np
+
+# How a message was matched to its person, stored as the index in here
+MATCH_KINDS = ("email", "name", "unmatched", "fuzzy_name")
+MATCH_EMAIL, MATCH_NAME, UNMATCHED, MATCH_FUZZY_NAME = range(len(MATCH_KINDS))
+
+
+class MessageStore:
+    """
+    Columnar storage of matched messages
+    All we ever report on is counts and times, so instead of keeping every EmailMessage alive we keep
+    parallel arrays of (person index, receive time, sender id, match kind, source id), which is 21 bytes per message
+    """
+
+    COLUMNS = ("person", "receive_time", "sender", "match_kind", "source")
+
+    def __init__(self, interned: 'MessageStore | None' = None):
+        self.person = array("i")
+        self.receive_time = array("q")
+        self.sender = array("i")
+        self.match_kind = array("b")
+        self.source = array("i")
+
+        # Sharing another store's senders / sources means sender and source ids are the same in both,
+        # so rows can be moved between them
+        if interned is not None:
+            self.sender_ids, self.senders = interned.sender_ids, interned.senders
+            self.source_ids, self.sources = interned.source_ids, interned.sources
+            return
+
+        # Senders are interned, (name, email) -> sender id and the other way around
+        self.sender_ids: dict[tuple[str, str | None], int] = {}
+        self.senders: list[tuple[str, str | None]] = []
+
+        # Same for the export each message came from
+        self.source_ids: dict[str | None, int] = {}
+        self.sources: list[str | None] = []
+
+    def __len__(self):
+        return len(self.person)
+
+    def intern_sender(self, name: str, email: str | None) -> int:
+        key = (name, email)
+        if (sender_id := self.sender_ids.get(key)) is None:
+            sender_id = self.sender_ids[key] = len(self.senders)
+            self.senders.append(key)
+
+        return sender_id
+
+    def intern_source(self, source: str | None) -> int:
+        if (source_id := self.source_ids.get(source)) is None:
+            source_id = self.source_ids[source] = len(self.sources)
+            self.sources.append(source)
+
+        return source_id
+
+    def add(self, person_index: int, receive_time: int, sender_id: int, match_kind: int = MATCH_EMAIL, source_id: int = 0):
+        self.person.append(person_index)
+        self.receive_time.append(receive_time)
+        self.sender.append(sender_id)
+        self.match_kind.append(match_kind)
+        self.source.append(source_id)
+
+    def truncate(self, length: int):
+        """
+        Drops every message after the first length, used to roll back a run that got cancelled
+        Interned senders / sources are kept since they're shared
+        """
+        for column in MessageStore.COLUMNS:
+            del getattr(self, column)[length:]
+
+    def rows_by_sender(self, sender_ids: list[int]) -> dict[int, np.ndarray]:
+        """
+        Row numbers of every message from each of sender_ids
+        """
+        if not self.sender:
+            return {i: np.zeros(0, dtype=np.int64) for i in sender_ids}
+
+        senders = np.frombuffer(self.sender, dtype=np.int32)
+        rows = np.flatnonzero(np.isin(senders, sender_ids))
+        row_senders = senders[rows]
+
+        return {i: rows[row_senders == i] for i in sender_ids}
+
+    def set_person(self, rows: np.ndarray, person_index: int, match_kind: int):
+        for row in rows.tolist():
+            self.person[row] = person_index
+            self.match_kind[row] = match_kind
+
+    def copy_rows(self, other: 'MessageStore', rows: np.ndarray, person_index: int, match_kind: int):
+        """
+        Adds rows of other (which has to share this store's senders / sources) to the end, given to person_index
+        """
+        for row in rows.tolist():
+            self.add(person_index, other.receive_time[row], other.sender[row], match_kind, other.source[row])
+
+    def drop_rows(self, rows: np.ndarray):
+        """
+        Removes rows, the messages after them move up
+        """
+        if not len(rows):
+            return
+
+        keep = np.ones(len(self), dtype=bool)
+        keep[rows] = False
+
+        for column in MessageStore.COLUMNS:
+            old = getattr(self, column)
+            new = array(old.typecode)
+            new.frombytes(np.frombuffer(old, dtype=old.typecode)[keep].tobytes())
+            setattr(self, column, new)
+
+    def people_array(self) -> np.ndarray:
+        # Copying so the arrays can still grow, they can't while numpy has a view of them
+        return np.frombuffer(self.person, dtype=np.int32).astype(np.int64) if self.person else np.zeros(0, dtype=np.int64)
+
+    def times_array(self) -> np.ndarray:
+        return np.frombuffer(self.receive_time, dtype=np.int64).copy() if self.receive_time else np.zeros(0, dtype=np.int64)
+
+    def counts(self, num_people: int) -> np.ndarray:
+        """
+        Number of messages per person index
+        """
+        return np.bincount(self.people_array(), minlength=num_people)
@@ -0,0 +1,244 @@
+"""
+Runs decoding, body parsing and matching at the same time, as stages connected by bounded queues
+
+    decode (thread, its own process pool)  ->  parse (process pool, only with bodies)  ->  match (event loop)
+
+Messages move between stages in batches. A full queue makes the stage before it wait, so a slow matcher doesn't
+let decoded messages pile up in memory. run() gives back an async stream of Progress events and one Finished event
+
+    async with contextlib.aclosing(pipeline.run(manager, files)) as events:
+        async for event in events:
+            ...
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, NamedTuple
+
+import batch
+import body_parser
+import data_parser
+from data_parser import EmailMessage, ExtractionOptions, TrackerManager
+from extraction_cache import ExtractionCache
+
+# Messages per batch, so the queues aren't touched for every single message
+BATCH_SIZE = 500
+# Batches a queue holds before the stage in front of it has to wait
+QUEUE_BATCHES = 8
+# Seconds between Progress events
+PROGRESS_INTERVAL = 0.25
+
+
+class Progress(NamedTuple):
+    done: int
+    # Messages in the exports, less the duplicates across inboxes dropped so far. Duplicates are only known once
+    # an export is decoded, so with several exports it's the most there can be until they all are (total_exact)
+    total: int
+    # Only known when there's a single export, both are 0 otherwise
+    folders_done: int
+    total_folders: int
+    # Messages matched per second so far
+    rate: float
+    total_exact: bool
+
+
+class Finished(NamedTuple):
+    unknown_emails: set[tuple[str, str]]
+    messages: int
+    seconds: float
+
+
+def _parse_bodies(htmls: list[bytes | None]) -> tuple[list[str], float]:
+    """
+    Runs in a parse worker, gives back the parsed bodies and how long they took
+    """
+    start = time.perf_counter()
+    return [body_parser.parse_html(i) for i in htmls], time.perf_counter() - start
+
+
+def _iter_messages(email_export_files: list[str], decode_workers: int, with_body: bool, cache: ExtractionCache | None,
+                   options: ExtractionOptions, progress: data_parser.ProgressCallback,
+                   file_stats: list[batch.FileStats]) -> Iterator[EmailMessage]:
+    """
+    Same messages the GUI has always matched: a single export is decoded with a process pool, several exports
+    get a process each (and duplicates across inboxes are dropped, see file_stats for how many)
+    Bodies are parsed by the parse stage, so with_body decodes one export at a time in this thread
+    """
+    if len(email_export_files) == 1 or with_body:
+        for email_export_file in email_export_files:
+            messages = data_parser.iter_emails(email_export_file, workers=1 if with_body else decode_workers,
+                                               cache=cache, progress=progress, options=options)
+            try:
+                yield from messages
+            finally:
+                messages.close()
+    else:
+        messages = batch.iter_batch_emails(email_export_files, decode_workers, cache.cache_file if cache else None,
+                                           file_stats, options)
+        try:
+            yield from messages
+        finally:
+            messages.close()
+
+
+async def run(manager: TrackerManager, email_export_files: list[str], decode_workers: int | None = None,
+              parse_workers: int | None = None, with_body: bool = False, cache: ExtractionCache | None = None,
+              options: ExtractionOptions = ExtractionOptions(), queue_batches: int = QUEUE_BATCHES,
+              progress_interval: float = PROGRESS_INTERVAL, cancel: threading.Event | None = None) -> AsyncIterator[Progress | Finished]:
+    """
+    Matches every message of the exports into the manager, yields Progress every progress_interval seconds and
+    Finished at the end
+    decode_workers / parse_workers are processes (None is one per CPU), parse workers are only started with with_body
+    Closing the stream early stops every stage, messages matched so far stay in the manager
+    Setting cancel (ie. from a Cancel button) does the same, and also stops the counting / decoding done before the
+    first event, the stream then ends without a Finished
+    """
+    loop = asyncio.get_running_loop()
+    decode_workers = decode_workers or os.cpu_count() or 1
+    parse_workers = parse_workers or os.cpu_count() or 1
+
+    # Set when the stream is closed, the decode thread checks it between messages
+    stop = threading.Event()
+    # Exports decoded so far, for the duplicates dropped (only filled in when they're decoded together)
+    file_stats: list[batch.FileStats] = []
+    # Duplicates are only dropped when several exports are decoded together, see _iter_messages()
+    deduplicated = len(email_export_files) > 1 and not with_body
+
+    def stopped() -> bool:
+        return stop.is_set() or (cancel is not None and cancel.is_set())
+
+    decoded: asyncio.Queue = asyncio.Queue(queue_batches)
+    parsed: asyncio.Queue = asyncio.Queue(queue_batches)
+    # (folders done, total folders), written by the decode thread
+    folders = [0, 0]
+
+    def folder_done(done: int, total_folders: int):
+        folders[:] = done, total_folders
+
+    def put(queue: asyncio.Queue, item) -> bool:
+        """
+        Puts into a queue from the decode thread, waiting while it's full, False if the stream was closed
+        """
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stopped():
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                continue
+
+        future.cancel()
+        return False
+
+    def decode():
+        messages = _iter_messages(email_export_files, decode_workers, with_body, cache, options, folder_done, file_stats)
+        try:
+            chunk = []
+            for m in messages:
+                if stopped():
+                    return
+
+                # The handle can't go to the parse workers, only its html can
+                chunk.append((m, m.take_html()) if with_body else m)
+                if len(chunk) >= BATCH_SIZE:
+                    if not put(decoded, chunk):
+                        return
+                    chunk = []
+
+            if chunk:
+                put(decoded, chunk)
+        finally:
+            messages.close()
+            put(decoded, None)
+
+    async def parse(pool: ProcessPoolExecutor):
+        while (chunk := await decoded.get()) is not None:
+            messages, htmls = zip(*chunk)
+            # Several batches are parsed at once, the match stage waits on them in order
+            await parsed.put((messages, loop.run_in_executor(pool, _parse_bodies, list(htmls))))
+
+        await parsed.put(None)
+
+    def count() -> int:
+        total = 0
+        for i in email_export_files:
+            if stopped():
+                break
+            total += data_parser.count_emails(i, options)
+
+        return total
+
+    # Opening every export to count them can take a while, so a cancel is checked while waiting on it
+    counting = loop.run_in_executor(None, count)
+    while not counting.done():
+        if stopped():
+            return
+        await asyncio.wait([counting], timeout=progress_interval)
+    total = counting.result()
+
+    decode_pool = ThreadPoolExecutor(max_workers=1)
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=data_parser.WORKER_CONTEXT) if with_body else None
+    decoding = loop.run_in_executor(decode_pool, decode)
+    parsing = asyncio.create_task(parse(parse_pool)) if with_body else None
+
+    try:
+        unknown_emails = set()
+        done = 0
+        start = last_progress = time.monotonic()
+
+        with manager.matching_run(unknown_emails) as match_email:
+            while True:
+                # Nothing might come for a while (ie. a big export decoding), so a cancel is checked while waiting
+                if stopped():
+                    return
+                try:
+                    item = await asyncio.wait_for((parsed if with_body else decoded).get(), progress_interval)
+                except TimeoutError:
+                    continue
+                if item is None:
+                    break
+
+                if with_body:
+                    messages, bodies = item
+                    bodies, seconds = await bodies
+                    data_parser.stats.add_time("html_parse", seconds, len(bodies))
+
+                    for m, body in zip(messages, bodies):
+                        m.email_contents = body
+                else:
+                    messages = item
+
+                for m in messages:
+                    match_email(m)
+                done += len(messages)
+
+                if (now := time.monotonic()) - last_progress >= progress_interval:
+                    last_progress = now
+                    duplicates = sum(i.duplicates for i in file_stats)
+                    yield Progress(done, total - duplicates, *folders, done / max(now - start, 1e-9),
+                                   not deduplicated or len(file_stats) == len(email_export_files))
+
+        # Anything that went wrong while decoding is raised here
+        await decoding
+        if parsing is not None:
+            await parsing
+
+        yield Finished(unknown_emails, done, time.monotonic() - start)
+    finally:
+        stop.set()
+        if parsing is not None:
+            parsing.cancel()
+
+        # Waits for the decode thread to stop, it closes its own process pools
+        try:
+            await decoding
+        except Exception:
+            pass
+
+        decode_pool.shutdown()
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
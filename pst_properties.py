@@ -0,0 +1,74 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pypff
+
+# MAPI property ids (the top half of the property tag) of what matching needs, see [MS-OXPROPS]
+PR_SENT_REPRESENTING_NAME = 0x0042
+PR_SENT_REPRESENTING_ADDRTYPE = 0x0064
+PR_SENT_REPRESENTING_EMAIL_ADDRESS = 0x0065
+PR_SENDER_NAME = 0x0C1A
+PR_SENDER_ADDRTYPE = 0x0C1E
+PR_SENDER_EMAIL_ADDRESS = 0x0C1F
+PR_INTERNET_MESSAGE_ID = 0x1035
+PR_SENDER_SMTP_ADDRESS = 0x5D01
+PR_SENT_REPRESENTING_SMTP_ADDRESS = 0x5D02
+
+WANTED = frozenset((
+    PR_SENT_REPRESENTING_NAME, PR_SENT_REPRESENTING_ADDRTYPE, PR_SENT_REPRESENTING_EMAIL_ADDRESS, PR_SENDER_NAME,
+    PR_SENDER_ADDRTYPE, PR_SENDER_EMAIL_ADDRESS, PR_INTERNET_MESSAGE_ID, PR_SENDER_SMTP_ADDRESS,
+    PR_SENT_REPRESENTING_SMTP_ADDRESS,
+))
+
+# Where the sender's address can be, best first. The From header is the "sent representing" address, so that
+# goes first to get the same address as the header would
+# (SMTP address, address type, address)
+SENDER_ADDRESSES = (
+    (PR_SENT_REPRESENTING_SMTP_ADDRESS, PR_SENT_REPRESENTING_ADDRTYPE, PR_SENT_REPRESENTING_EMAIL_ADDRESS),
+    (PR_SENDER_SMTP_ADDRESS, PR_SENDER_ADDRTYPE, PR_SENDER_EMAIL_ADDRESS),
+)
+
+
+def read_properties(message: 'pypff.message') -> dict[int, str]:
+    """
+    The properties in WANTED that the message has, as strings
+    Goes through the message's property table once and only reads the values we want, so the body, the
+    transport headers and the attachments are never read
+    """
+    properties = {}
+    if not message.number_of_record_sets:
+        return properties
+
+    for entry in message.get_record_set(0).entries:
+        if (entry_type := entry.entry_type) in WANTED and entry_type not in properties:
+            try:
+                properties[entry_type] = entry.data_as_string
+            except (IOError, TypeError, ValueError):
+                # Not a string, or a broken value, same as not having it
+                pass
+
+    return properties
+
+
+def sender_email(properties: dict[int, str]) -> str | None:
+    """
+    The sender's SMTP address, None if there's only an Exchange (X.500) one
+    """
+    for smtp, address_type, address in SENDER_ADDRESSES:
+        if properties.get(smtp):
+            return properties[smtp]
+        elif (properties.get(address_type) or "").upper() == "SMTP" and properties.get(address):
+            return properties[address]
+
+    return None
+
+
+def sender_name(properties: dict[int, str]) -> str | None:
+    return properties.get(PR_SENDER_NAME) or None
+
+
+def message_id(properties: dict[int, str]) -> str | None:
+    """
+    Same as the Message-ID header, see header_parser.parse_message_id()
+    """
+    return (properties.get(PR_INTERNET_MESSAGE_ID) or "").strip() or None
@@ -0,0 +1,249 @@
+import sqlite3
+from typing import Iterable
+
+import numpy as np
+
+from histogram import Histogram
+from message_store import MATCH_KINDS, MessageStore
+
+# Bump this whenever the tables change so old stores get rebuilt
+SCHEMA_VERSION = 1
+
+# What totals() can group by: (column of messages, table it points to, column of that table to group by)
+GROUPS = {
+    "person": ("person_id", None, None),
+    "tracker": ("person_id", "people", "tracker"),
+    "source": ("source_id", "sources", "name"),
+    "match_kind": ("match_kind", None, None),
+    "sender": ("sender_id", "senders", "email"),
+}
+
+INDEXES = {
+    "messages_person": "messages(person_id, receive_time)",
+    "messages_time": "messages(receive_time)",
+    "messages_sender": "messages(sender_id)",
+}
+
+# Writing more messages than this at once drops the indexes and builds them again after, which is a lot
+# faster than updating them for every row
+BULK_WRITE_ROWS = 100000
+
+
+class ResultStore:
+    """
+    SQLite copy of the matched messages, so reports can be made with SQL (and after the program is closed)
+    without re-running the exports
+
+    Tables are people (id is the person's index in TrackerManager.people), senders, sources (the export each
+    message came from) and messages, which has how each message was matched in match_kind
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+
+        with self.connection:
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                for table in ("messages", "senders", "sources", "people"):
+                    self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+
+                self.connection.execute("""
+                    CREATE TABLE people (
+                        id INTEGER PRIMARY KEY,
+                        first_name TEXT,
+                        preferred_name TEXT,
+                        last_name TEXT,
+                        email TEXT,
+                        tracker TEXT
+                    )
+                """)
+                self.connection.execute("CREATE TABLE senders (id INTEGER PRIMARY KEY, name TEXT, email TEXT)")
+                self.connection.execute("CREATE TABLE sources (id INTEGER PRIMARY KEY, name TEXT)")
+                self.connection.execute("""
+                    CREATE TABLE messages (
+                        person_id INTEGER NOT NULL REFERENCES people(id),
+                        receive_time INTEGER NOT NULL,
+                        sender_id INTEGER NOT NULL REFERENCES senders(id),
+                        source_id INTEGER NOT NULL REFERENCES sources(id),
+                        match_kind TEXT NOT NULL
+                    )
+                """)
+                self.connection.execute("CREATE INDEX senders_email ON senders(email)")
+                self._create_indexes()
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        # How much of the manager has been written already, see sync()
+        self.people_written = 0
+        self.messages_written = 0
+        self.senders_written = 0
+        self.sources_written = 0
+
+    def close(self):
+        self.connection.close()
+
+    def _create_indexes(self):
+        for name, columns in INDEXES.items():
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+    def _drop_indexes(self):
+        for name in INDEXES:
+            self.connection.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def clear(self):
+        with self.connection:
+            for table in ("messages", "senders", "sources", "people"):
+                self.connection.execute(f"DELETE FROM {table}")
+
+        self.people_written = self.messages_written = self.senders_written = self.sources_written = 0
+
+    def reset_messages(self):
+        """
+        Messages get written again from scratch on the next sync, for when they were changed in place
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM messages")
+
+        self.messages_written = 0
+
+    def sync(self, people: Iterable[tuple[int, str, str, str, str, str | None]], messages: MessageStore):
+        """
+        Writes whatever was added since the last sync, people are (id, first, preferred, last, email, tracker)
+        and only the ones past the ones already written are used
+        If messages got truncated (a cancelled run), they're written again from scratch
+        """
+        with self.connection:
+            if len(messages) < self.messages_written:
+                self.connection.execute("DELETE FROM messages")
+                self.messages_written = 0
+
+            new_people = [i for i in people if i[0] >= self.people_written]
+            self.connection.executemany("INSERT INTO people VALUES (?, ?, ?, ?, ?, ?)", new_people)
+            self.people_written += len(new_people)
+
+            self.connection.executemany(
+                "INSERT INTO senders VALUES (?, ?, ?)",
+                ((i, *j) for i, j in enumerate(messages.senders[self.senders_written:], self.senders_written))
+            )
+            self.senders_written = len(messages.senders)
+
+            self.connection.executemany(
+                "INSERT INTO sources VALUES (?, ?)",
+                enumerate(messages.sources[self.sources_written:], self.sources_written)
+            )
+            self.sources_written = len(messages.sources)
+
+            start = self.messages_written
+            bulk = len(messages) - start > BULK_WRITE_ROWS
+            if bulk:
+                self._drop_indexes()
+
+            self.connection.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+                zip(messages.person[start:], messages.receive_time[start:], messages.sender[start:],
+                    messages.source[start:], (MATCH_KINDS[i] for i in messages.match_kind[start:]))
+            )
+            self.messages_written = len(messages)
+
+            if bulk:
+                self._create_indexes()
+
+    def totals(self, group_by: str = "person", start: int | None = None, end: int | None = None) -> dict:
+        """
+        Number of messages per person / tracker / source / match_kind / sender (email), optionally only
+        the ones received in [start, end) ms
+        """
+        column, table, label = GROUPS[group_by]
+        where, params = self._time_range(start, end)
+
+        # Counting first and joining after is much faster than joining every message
+        counts = f"SELECT {column} AS key, COUNT(*) AS count FROM messages m {where} GROUP BY {column}"
+        if table is not None:
+            counts = f"SELECT t.{label}, SUM(c.count) FROM ({counts}) c JOIN {table} t ON t.id = c.key GROUP BY t.{label}"
+
+        return dict(self.connection.execute(counts, params))
+
+    def bucket(self, start: int, bin_ms: int, num_bins: int, person_id: int | None = None, source: str | None = None) -> Histogram:
+        """
+        Same as histogram.bucket() over the stored messages, optionally only for one person / source
+        """
+        filters, params = [], {"start": start, "bin_ms": bin_ms, "person_id": person_id, "source": source}
+        if person_id is not None:
+            filters.append("person_id = :person_id")
+        if source is not None:
+            filters.append("source_id IN (SELECT id FROM sources WHERE name = :source)")
+
+        rows = self.connection.execute(f"""
+            SELECT 0, MAX((receive_time - :start) / :bin_ms, 0) AS bin, COUNT(*), SUM(receive_time < :start) FROM messages
+            {"WHERE " + " AND ".join(filters) if filters else ""}
+            GROUP BY bin
+        """, params)
+
+        counts, before, after = self._histogram(rows, 1, num_bins)
+        return Histogram(counts[0], before, after)
+
+    def bucket_by_person(self, start: int, bin_ms: int, num_bins: int, num_people: int) -> Histogram:
+        """
+        Same as histogram.bucket_by_person() over the stored messages
+        """
+        rows = self.connection.execute("""
+            SELECT person_id, MAX((receive_time - :start) / :bin_ms, 0) AS bin, COUNT(*), SUM(receive_time < :start) FROM messages
+            GROUP BY person_id, bin
+        """, {"start": start, "bin_ms": bin_ms})
+
+        return self._histogram(rows, num_people, num_bins)
+
+    @staticmethod
+    def _histogram(rows: Iterable[tuple[int, int, int, int]], num_people: int, num_bins: int) -> Histogram:
+        """
+        Per person histogram out of (person, bin, count, count before start) rows
+        Like histogram.py, anything before the start is in the first bin and anything past the last bin is dropped
+        """
+        counts = np.zeros((num_people, num_bins), dtype=np.int64)
+        before = after = 0
+
+        for person, bin_, count, count_before in rows:
+            before += count_before
+            if bin_ >= num_bins:
+                after += count
+            else:
+                counts[person, bin_] += count
+
+        return Histogram(counts, before, after)
+
+    def people(self) -> list[tuple[int, str, str, str, str]]:
+        """
+        (id, first name, preferred name, last name, tracker email) of everyone
+        """
+        return self.connection.execute("SELECT id, first_name, preferred_name, last_name, email FROM people ORDER BY id").fetchall()
+
+    def messages_for(self, person_id: int, start: int | None = None, end: int | None = None) -> list[tuple]:
+        """
+        (receive time, sender name, sender email, source, match kind) of every message of a person
+        """
+        where, params = self._time_range(start, end)
+
+        return self.connection.execute(f"""
+            SELECT m.receive_time, s.name, s.email, src.name, m.match_kind FROM messages m
+            JOIN senders s ON s.id = m.sender_id
+            JOIN sources src ON src.id = m.source_id
+            {where} {"AND" if where else "WHERE"} m.person_id = ?
+            ORDER BY m.receive_time
+        """, (*params, person_id)).fetchall()
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """
+        For anything else, ie. `store.query("SELECT COUNT(*) FROM messages WHERE match_kind = 'name'")`
+        """
+        return self.connection.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _time_range(start: int | None, end: int | None) -> tuple[str, list[int]]:
+        filters, params = [], []
+        if start is not None:
+            filters.append("m.receive_time >= ?")
+            params.append(start)
+        if end is not None:
+            filters.append("m.receive_time < ?")
+            params.append(end)
+
+        return ("WHERE " + " AND ".join(filters)) if filters else "", params
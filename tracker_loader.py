@@ -0,0 +1,175 @@
+import csv
+import os
+import re
+from operator import itemgetter
+from typing import Iterator, NamedTuple
+
+# Human inputted emails in the notes column
+EMAIL_PATTERN = re.compile(r"[^\s@]+@[^\s@]+")
+
+# Header names of every column we use (lowercase, extra spaces removed), the first one found wins
+COLUMNS = {
+    "first_name": ("first name",),
+    "preferred_name": ("preferred name",),
+    "last_name": ("last name",),
+    "email": ("email contact", "email address", "utoronto email"),
+    "notes": ("notes",),
+}
+
+FIELDS = ("first_name", "preferred_name", "last_name", "email", "notes")
+
+# Where the columns are in the sharepoint export, for files that don't have a header we recognize
+DEFAULT_COLUMNS = {"first_name": 0, "preferred_name": 1, "last_name": 2, "email": 3, "notes": 8}
+
+TRACKER_EXTENSIONS = (".csv", ".xlsx")
+
+
+class TrackerEntry(NamedTuple):
+    first_name: str
+    preferred_name: str
+    last_name: str
+    # Email from the tracker first, then the ones in the notes
+    emails: list[str]
+    # Tracker file the person came from
+    tracker: str
+
+
+# Columns we can still do without, if a header doesn't have one it's taken from DEFAULT_COLUMNS (when that column
+# doesn't have a header we know) or left blank
+FALLBACK_FIELDS = ("first_name", "email", "notes")
+
+# Byte order mark Excel / SharePoint put at the start of "CSV UTF-8" files, and what it looks like read as latin-1
+BYTE_ORDER_MARKS = ("\ufeff", "\xef\xbb\xbf")
+
+# (tracker, warning) already printed by find_columns(), trackers get loaded again (ie. every time the GUI loads
+# files) and the same warning every time is just noise
+_warned: set[tuple[str, str]] = set()
+
+
+def _warn(tracker: str, warning: str):
+    if (tracker, warning) not in _warned:
+        _warned.add((tracker, warning))
+        print(f"{tracker or 'Tracker'} {warning}")
+
+
+def _normalize_header(value) -> str:
+    value = str(value or "")
+    for mark in BYTE_ORDER_MARKS:
+        value = value.removeprefix(mark)
+
+    return " ".join(value.lower().split())
+
+
+def find_columns(header: list, tracker: str = "") -> dict[str, int] | None:
+    """
+    Index of every column in COLUMNS, None if the row isn't a header (no last name column)
+    Missing first name / email / notes columns are taken from DEFAULT_COLUMNS if that column's header isn't one we
+    know, otherwise they're left out. Either way a warning is printed, once per tracker
+    """
+    names = [_normalize_header(i) for i in header]
+
+    columns = {}
+    for column, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                columns[column] = names.index(alias)
+                break
+
+    if "last_name" not in columns:
+        return None
+
+    known = set(columns.values())
+    for column in FALLBACK_FIELDS:
+        if column in columns:
+            continue
+        elif (index := DEFAULT_COLUMNS[column]) < len(names) and index not in known:
+            _warn(tracker, f"has no {column.replace('_', ' ')} column, using column {index + 1} (`{header[index]}`)")
+            columns[column] = index
+        else:
+            _warn(tracker, f"has no {column.replace('_', ' ')} column, leaving it blank")
+
+    return columns
+
+
+def _iter_csv_sheets(tracker_file: str) -> Iterator[Iterator[list]]:
+    """
+    A CSV is a single sheet
+    """
+    with open(tracker_file, encoding="latin-1", newline="") as f:
+        yield csv.reader(f)
+
+
+def _iter_xlsx_sheets(tracker_file: str) -> Iterator[Iterator[list]]:
+    """
+    Rows of every sheet, streamed in read only mode so big trackers aren't loaded all at once
+    """
+    try:
+        import openpyxl
+    except ImportError:
+        print("Reading .xlsx trackers needs openpyxl, install it with `python3 -m pip install openpyxl`")
+        return
+
+    workbook = openpyxl.load_workbook(tracker_file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield (["" if i is None else str(i) for i in row] for row in sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def iter_tracker(tracker_file: str) -> Iterator[TrackerEntry]:
+    """
+    People in a tracker export (.csv or .xlsx), columns are found by their header
+    CSVs without a header we know are read with the sharepoint export's layout, sheets without one are skipped
+    (they're usually instructions / summaries)
+    """
+    tracker = os.path.basename(tracker_file)
+    is_xlsx = tracker_file.lower().endswith(".xlsx")
+
+    for rows in _iter_xlsx_sheets(tracker_file) if is_xlsx else _iter_csv_sheets(tracker_file):
+        yield from _iter_sheet(rows, tracker, is_xlsx)
+
+
+def _iter_sheet(rows: Iterator[list], tracker: str, skip_unknown: bool) -> Iterator[TrackerEntry]:
+    if (header := next(rows, None)) is None:
+        return
+
+    if (columns := find_columns(header, tracker)) is None:
+        if skip_unknown:
+            return
+        # Not a header, skipping it like we always did
+        columns = DEFAULT_COLUMNS
+
+    # Columns that aren't there read a blank put at the end of every row, rows that are too short for a column are
+    # padded with blanks. Rows that stop before the last name / email are skipped like they always were
+    indexes = [columns.get(i, -1) for i in FIELDS]
+    missing = -1 in indexes
+    width = max(indexes) + 1
+    required = max(columns["last_name"], columns.get("email", 0)) + 1
+    padding = [""] * width
+    get_fields = itemgetter(*indexes)
+
+    for row in rows:
+        if len(row) < width:
+            if len(row) < required:
+                continue
+            row += padding[len(row):]
+        if missing:
+            row.append("")
+
+        first, preferred, last, email, notes = get_fields(row)
+
+        # Blank Lines - Everyone should have a last name
+        if not last.strip():
+            continue
+
+        # Human inputted emails in the notes
+        yield TrackerEntry(first, preferred, last, [email, *EMAIL_PATTERN.findall(notes)] if notes else [email], tracker)
+
+
+def entry_key(entry: TrackerEntry) -> tuple[str, str, str]:
+    """
+    Same student in more than one tracker, they'll have the same name and tracker email
+    """
+    return entry.first_name.strip().lower(), entry.last_name.strip().lower(), entry.emails[0].strip().lower()
+